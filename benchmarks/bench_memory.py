@@ -0,0 +1,126 @@
+"""
+Runs an SCRPCClient through many simulated job cycles against a stand-in SC
+server and coin daemon, sampling RSS and the largest session identity map
+seen inside the jobs as it goes. A long running scheduler should stay flat.
+
+    python benchmarks/bench_memory.py [cycles] [payouts per pull]
+"""
+import json
+import logging
+import os
+import resource
+import shutil
+import sys
+import tempfile
+
+from simplecoin_rpc_client.sc_rpc import SCRPCClient
+
+
+logger = logging.getLogger('bench_memory')
+
+
+def rss_kb():
+    """ Current resident set size. Falls back to peak RSS off Linux """
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * resource.getpagesize() / 1024
+    except IOError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+class Tx(object):
+    fee = 0.0001
+    confirmations = 1000
+
+
+class StandInCoinRPC(object):
+    coinserv = {'account': 'pool'}
+
+    def __init__(self):
+        self.sent = 0
+
+    def poke_rpc(self):
+        pass
+
+    def get_balance(self, account):
+        return 10 ** 8
+
+    def send_many(self, account, amounts):
+        self.sent += 1
+        return "{:064x}".format(self.sent), Tx()
+
+    def get_transaction(self, txid):
+        return Tx()
+
+
+class Response(object):
+    status_code = 200
+
+    def __init__(self, text):
+        self.text = text
+
+    def json(self):
+        return json.loads(self.text)
+
+
+class StandInSC(object):
+    """ Hands out `per_pull` new payouts on every get_payouts and accepts
+    every update """
+    def __init__(self, serializer, per_pull):
+        self.serializer = serializer
+        self.per_pull = per_pull
+        self.next_pid = 0
+
+    def post(self, url, data=None, **kwargs):
+        if url.endswith('get_payouts'):
+            pids = []
+            for i in xrange(self.next_pid, self.next_pid + self.per_pull):
+                pids.append(['user', 'mipcBbFg9gMiCh81Kj8tqqdgoZub1ZJRfn',
+                             '0.01', str(i)])
+            self.next_pid += self.per_pull
+            return Response(self.serializer.dumps({'pids': pids}))
+        return Response(self.serializer.dumps({'result': True, 'success': True}))
+
+    def get(self, url, **kwargs):
+        return Response(json.dumps({'success': True, 'objects': []}))
+
+
+def main(cycles, per_pull):
+    db_dir = tempfile.mkdtemp()
+    config = dict(currency_code='LTC', valid_address_versions=[111],
+                  rpc_signature='bench', rpc_url='http://localhost/',
+                  database_path=os.path.join(db_dir, 'rpc_'), log_path=None,
+                  minimum_tx_output=0)
+    sc_rpc = SCRPCClient(config, StandInCoinRPC(), logger=logger)
+    sc_rpc.http = StandInSC(sc_rpc.serializer, per_pull)
+
+    # Each job's session is replaced as it returns, so the identity map is
+    # sampled from inside the jobs, whenever they commit
+    peak = [0]
+    commit = sc_rpc.storage.commit
+
+    def sampling_commit():
+        peak[0] = max(peak[0], len(sc_rpc.db.session.identity_map))
+        commit()
+    sc_rpc.storage.commit = sampling_commit
+
+    print("{:>8} {:>10} {:>14}".format("cycle", "rss (KB)", "identity map"))
+    try:
+        for cycle in xrange(1, cycles + 1):
+            sc_rpc.pull_payouts()
+            # A "nightly" run every 60 pulls
+            if cycle % 60 == 0:
+                sc_rpc.send_payout()
+                sc_rpc.associate_all()
+                sc_rpc.confirm_trans()
+            if cycle % 60 == 0 or cycle == 1:
+                print("{:>8,} {:>10,} {:>14,}".format(cycle, rss_kb(), peak[0]))
+                peak[0] = 0
+    finally:
+        shutil.rmtree(db_dir)
+
+
+if __name__ == "__main__":
+    cycles = int(sys.argv[1]) if len(sys.argv) > 1 else 1440
+    per_pull = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+    main(cycles, per_pull)
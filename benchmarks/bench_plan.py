@@ -0,0 +1,116 @@
+"""
+Times building a payout plan from unpaid payouts, comparing how send_payout
+did it just before PayoutPlan (PayoutRows by address, summed with
+to_base_units into a dictionary) with PayoutPlan (NumPy if installed, and the
+array module fallback). Also times loading the unpaid payouts from SQLite as
+PayoutRows by address versus as columns.
+
+The original send_payout, which summed floats over ORM Payout objects, isn't
+timed: it unlocked each dropped address by scanning every payout, so it
+doesn't finish in reasonable time at these sizes.
+
+    python benchmarks/bench_plan.py [rows] [addresses]
+"""
+import datetime
+import gc
+import logging
+import os
+import random
+import sys
+import tempfile
+import time
+import sqlalchemy as sa
+
+from sqlalchemy.orm import sessionmaker
+from simplecoin_rpc_client import plan as plan_module
+from simplecoin_rpc_client.plan import PayoutPlan
+from simplecoin_rpc_client.storage import storages, to_base_units, COIN
+
+
+MINIMUM_TX_OUTPUT = 0.00001
+OUTPUT_LIMIT = 10000
+
+# Records are still built for the warnings about dropped addresses, as they
+# were in send_payout, but go nowhere
+logger = logging.getLogger('bench_plan')
+logger.addHandler(logging.NullHandler())
+logger.propagate = False
+
+
+def previous_plan(unpaid):
+    """ send_payout and _plan_payout just before PayoutPlan, from
+    address -> [PayoutRow] """
+    address_totals = {}
+    pids = {}
+    for address, payouts in unpaid.iteritems():
+        address_totals[address] = sum(to_base_units(p.amount) for p in payouts)
+        pids[address] = [p.pid for p in payouts]
+
+    plan = {}
+    for i, (address, amount) in enumerate(address_totals.iteritems()):
+        amount = round(float(amount) / COIN, 8)
+        if amount < MINIMUM_TX_OUTPUT or i > OUTPUT_LIMIT:
+            logger.warn('Removing {} with payout amount of {} (which '
+                        'is lower than network output min of {}) from '
+                        'the {} payout dictionary'
+                        .format(address, amount, MINIMUM_TX_OUTPUT, 'LTC'))
+        else:
+            plan[address] = amount
+    paid_pids = [pid for address in plan for pid in pids[address]]
+    return plan, paid_pids
+
+
+def timed(label, func, *args):
+    t = time.time()
+    res = func(*args)
+    print("  {:<28} {:>8.3f}s".format(label, time.time() - t))
+    return res
+
+
+def main(rows, addresses):
+    random.seed(0)
+    path = os.path.join(tempfile.mkdtemp(), 'bench.sqlite')
+    engine = sa.create_engine('sqlite:///' + path)
+    db = sessionmaker(bind=engine)
+    db.session = db()
+    storage = storages['sqlite'](db, 'LTC')
+    storage.setup(engine)
+
+    now = datetime.datetime.utcnow()
+    print("Inserting {:,} payouts to {:,} addresses...".format(rows, addresses))
+    for start in xrange(0, rows, 100000):
+        storage.insert_payouts([
+            dict(pid=str(i), user='user',
+                 address='addr{}'.format(random.randrange(addresses)),
+                 amount='{:.8f}'.format(random.uniform(0, 0.001)),
+                 currency_code='LTC', pull_time=now)
+            for i in xrange(start, min(rows, start + 100000))])
+        storage.commit()
+
+    # Each stage starts without the previous stage's objects alive, so the
+    # cyclic garbage collector has the same amount to walk for each
+    print("Loading + planning as send_payout did before PayoutPlan")
+    unpaid = timed('unpaid_by_address', storage.unpaid_by_address)
+    storage.rollback()
+    timed('dictionaries', previous_plan, unpaid)
+    del unpaid
+    gc.collect()
+
+    print("Loading + planning with PayoutPlan")
+    pids, addrs, amounts = timed('unpaid_columns', storage.unpaid_columns)
+    storage.rollback()
+    numpy = plan_module.numpy
+    if numpy is not None:
+        timed('PayoutPlan (numpy)', PayoutPlan.from_rows, pids, addrs, amounts,
+              MINIMUM_TX_OUTPUT, OUTPUT_LIMIT)
+    plan_module.numpy = None
+    timed('PayoutPlan (array)', PayoutPlan.from_rows, pids, addrs, amounts,
+          MINIMUM_TX_OUTPUT, OUTPUT_LIMIT)
+    plan_module.numpy = numpy
+    os.remove(path)
+
+
+if __name__ == "__main__":
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    addresses = int(sys.argv[2]) if len(sys.argv) > 2 else 50000
+    main(rows, addresses)
@@ -0,0 +1,63 @@
+"""
+Times the payout storage engines through a payout cycle: insert, select
+unpaid by address, lock, set txid and mark associated.
+
+    python benchmarks/bench_storage.py [rows]
+"""
+import datetime
+import os
+import sys
+import tempfile
+import time
+import sqlalchemy as sa
+
+from sqlalchemy.orm import sessionmaker
+from simplecoin_rpc_client.storage import storages
+
+
+def make_db(name):
+    if name == 'memory':
+        engine = sa.create_engine('sqlite://')
+    else:
+        path = os.path.join(tempfile.mkdtemp(), 'bench.sqlite')
+        engine = sa.create_engine('sqlite:///' + path)
+    db = sessionmaker(bind=engine)
+    db.session = db()
+    return engine, db
+
+
+def bench(name, rows):
+    engine, db = make_db(name)
+    storage = storages[name](db, 'LTC')
+    storage.setup(engine)
+    now = datetime.datetime.utcnow()
+    payouts = [dict(pid=str(i), user='user', address='addr{}'.format(i % 5000),
+                    amount='0.01', currency_code='LTC', pull_time=now)
+               for i in xrange(rows)]
+
+    timings = []
+
+    def step(label, func, *args):
+        t = time.time()
+        res = func(*args)
+        storage.commit()
+        timings.append((label, time.time() - t))
+        return res
+
+    step('insert', storage.insert_payouts, payouts)
+    step('insert (repeat)', storage.insert_payouts, payouts)
+    unpaid = step('unpaid_by_address', storage.unpaid_by_address)
+    pids = [p.pid for addr_rows in unpaid.itervalues() for p in addr_rows]
+    step('lock', storage.lock, pids, now)
+    step('set_txid', storage.set_txid, pids, 'txid', now)
+    step('mark_associated', storage.mark_associated, 'txid', now)
+
+    print("{} engine, {:,} payouts".format(name, rows))
+    for label, elapsed in timings:
+        print("  {:<20} {:>8.3f}s".format(label, elapsed))
+
+
+if __name__ == "__main__":
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    for name in sorted(storages):
+        bench(name, rows)
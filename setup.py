@@ -12,5 +12,9 @@ setup(name='simplecoin_rpc_client',
               'simplecoin_rpc = simplecoin_rpc_client.manage:entry'
           ]
       },
+      extras_require={
+          # Vectorized payout planning, see simplecoin_rpc_client.plan
+          'numpy': ['numpy']
+      },
       packages=find_packages()
       )
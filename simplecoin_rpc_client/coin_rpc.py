@@ -0,0 +1,21 @@
+"""
+cryptokit's CoinRPC with the coin daemon calls it doesn't wrap itself. Going
+through methods here rather than CoinRPC.conn keeps the calls visible to
+RecordingCoinRPC and answerable by ReplayCoinRPC, and turns daemon and
+connection errors into CoinRPCException like the wrapped calls.
+"""
+from cryptokit.rpc import CoinRPCException
+from cryptokit.rpc_wrapper import CoinRPC as BaseCoinRPC
+
+
+class CoinRPC(BaseCoinRPC):
+    def listtransactions(self, account, count=10, skip=0):
+        """ The wallet's most recent transactions for account, skipping the
+        newest skip, as the daemon's dictionaries """
+        try:
+            return self.conn.listtransactions(account, count, skip)
+        except CoinRPCException:
+            raise
+        except Exception as e:
+            raise CoinRPCException({'code': None, 'message': "listtransactions "
+                                    "failed: {}".format(e)})
@@ -4,7 +4,7 @@ import argparse
 import yaml
 import sys
 
-from cryptokit.rpc_wrapper import CoinRPC
+from simplecoin_rpc_client.coin_rpc import CoinRPC
 from simplecoin_rpc_client.sc_rpc import SCRPCClient
 
 logger = logging.getLogger('apscheduler.scheduler')
@@ -32,6 +32,8 @@ def entry():
                         default='INFO')
     parser.add_argument('-cl', '--config-location',
                         default='/config.yml')
+    parser.add_argument('-p', '--profile', action='store_true', default=False,
+                        help='record timing spans and cProfile output per job run')
     args = parser.parse_args()
 
     # Setup logging
@@ -58,6 +60,8 @@ def entry():
         coin_rpc[cc] = CoinRPC(curr_cfg, logger=logger)
 
         curr_cfg.update(cfg['sc_rpc_client'])
+        if args.profile:
+            curr_cfg['profile'] = True
         sc_rpc[cc] = SCRPCClient(curr_cfg, coin_rpc[cc], logger=logger)
 
     function_args = []
@@ -0,0 +1,77 @@
+import sqlalchemy as sa
+
+from sqlalchemy.ext.declarative import declarative_base
+
+
+base = declarative_base()
+
+
+class Payout(base):
+    """ Our single table in the sqlite database. Handles tracking the status of
+    payouts and keeps track of tasks that needs to be retried, etc. """
+    __tablename__ = "payouts"
+    id = sa.Column(sa.Integer, primary_key=True)
+    pid = sa.Column(sa.String, unique=True, nullable=False)
+    user = sa.Column(sa.String, nullable=False)
+    address = sa.Column(sa.String, nullable=False)
+    # SQLlite does not have support for Decimal - use STR instead
+    amount = sa.Column(sa.String, nullable=False)
+    currency_code = sa.Column(sa.String, nullable=False)
+    txid = sa.Column(sa.String)
+    associated = sa.Column(sa.Boolean, default=False, nullable=False)
+    locked = sa.Column(sa.Boolean, default=False, nullable=False)
+
+    # Times
+    lock_time = sa.Column(sa.DateTime)
+    paid_time = sa.Column(sa.DateTime)
+    assoc_time = sa.Column(sa.DateTime)
+    pull_time = sa.Column(sa.DateTime)
+
+    @property
+    def trans_id(self):
+        if self.txid is None:
+            return "NULL"
+        return self.txid
+
+    @property
+    def amount_float(self):
+        return float(self.amount)
+
+    def tabulize(self, columns):
+        return [getattr(self, a) for a in columns]
+
+
+class OutboxMessage(base):
+    """ A message for SC that has been committed locally but not yet
+    acknowledged by SC. Written in the same transaction as the local state
+    change it describes and sent later by flush_outbox """
+    __tablename__ = "outbox"
+    __table_args__ = (sa.UniqueConstraint('action', 'txid'), )
+    id = sa.Column(sa.Integer, primary_key=True)
+    # The SC rpc method to post to. associate_payouts or confirm_transactions
+    action = sa.Column(sa.String, nullable=False)
+    txid = sa.Column(sa.String, nullable=False)
+    currency_code = sa.Column(sa.String, nullable=False)
+    # JSON encoded post data
+    data = sa.Column(sa.String, nullable=False)
+    attempts = sa.Column(sa.Integer, default=0, nullable=False)
+    last_error = sa.Column(sa.String)
+
+    # Times
+    created_time = sa.Column(sa.DateTime)
+    next_attempt_time = sa.Column(sa.DateTime, index=True)
+
+    def tabulize(self, columns):
+        return [getattr(self, a) for a in columns]
+
+
+class PendingBalance(base):
+    """ Running total of the unpaid, unlocked payouts to each address. Kept up
+    to date by the storage engine as payouts are inserted, locked, unlocked
+    and paid, so planning a payout doesn't need to scan every payout """
+    __tablename__ = "pending_balances"
+    currency_code = sa.Column(sa.String, primary_key=True)
+    address = sa.Column(sa.String, primary_key=True)
+    # In base units (satoshis) so the running sums are exact
+    amount = sa.Column(sa.BigInteger, default=0, nullable=False)
+    count = sa.Column(sa.Integer, default=0, nullable=False)
@@ -0,0 +1,167 @@
+"""
+Payout planning. Works out what a single payout transaction should send from
+the unpaid payouts of a currency.
+
+The pid, address and amount columns are loaded into compact arrays of
+integer base units, then grouped by address, summed, filtered for dust and
+ranked in whole-array passes. NumPy is used when it's installed, otherwise
+the standard library array module with plain loops.
+"""
+from array import array
+from collections import OrderedDict
+from itertools import izip
+
+from simplecoin_rpc_client.storage import COIN, to_base_units
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+# Plain decimal amounts with at most this many whole digits, and no more
+# decimals than base units have, convert to base units exactly through a
+# float64, which lets NumPy parse them in C
+FLOAT_SAFE_DIGITS = 7
+
+
+class PayoutPlan(object):
+    """ The outputs of one payout transaction.
+
+    amounts - address -> payable amount in coins, largest first
+    counts - address -> number of payouts making up the amount
+    total - total to be sent in base units
+    pids - the payouts paid by the transaction
+    dropped - (address, amount in coins) of outputs left out as dust or past
+              the output limit. Their payouts stay unpaid """
+    def __init__(self, addresses, totals, counts, pids=(), dropped=()):
+        self.amounts = OrderedDict(
+            (address, round(float(total) / COIN, 8))
+            for address, total in izip(addresses, totals))
+        self.counts = dict(izip(addresses, counts))
+        self.total = sum(totals)
+        self.pids = list(pids)
+        self.dropped = [(address, round(float(total) / COIN, 8))
+                        for address, total in dropped]
+
+    @property
+    def total_amount(self):
+        return float(self.total) / COIN
+
+    def __len__(self):
+        return len(self.amounts)
+
+    @classmethod
+    def from_rows(cls, pids, addresses, amounts, minimum_tx_output,
+                  payout_output_limit):
+        """ Plans a payout from unpaid payout columns. amounts are the stored
+        amount strings """
+        if not pids:
+            return cls([], [], [])
+        if numpy is not None:
+            return cls._from_rows_numpy(pids, addresses, amounts,
+                                        minimum_tx_output, payout_output_limit)
+        return cls._from_rows_array(pids, addresses, amounts,
+                                    minimum_tx_output, payout_output_limit)
+
+    @classmethod
+    def from_totals(cls, addresses, totals, counts, minimum_tx_output,
+                    payout_output_limit):
+        """ Plans a payout from per-address totals already in base units, such
+        as the pending balance aggregate. The plan has no pids """
+        minimum = to_base_units(repr(minimum_tx_output))
+        chosen, dropped = _rank(list(addresses), list(totals), minimum,
+                                payout_output_limit)
+        return cls([addresses[i] for i in chosen], [totals[i] for i in chosen],
+                   [counts[i] for i in chosen],
+                   dropped=[(addresses[i], totals[i]) for i in dropped])
+
+    @classmethod
+    def _from_rows_numpy(cls, pids, addresses, amounts, minimum_tx_output,
+                         payout_output_limit):
+        if _float_safe(numpy.array(amounts)):
+            values = numpy.array(amounts, dtype=numpy.float64)
+            units = numpy.rint(values * COIN).astype(numpy.int64)
+        else:
+            units = numpy.fromiter((to_base_units(a) for a in amounts),
+                                   numpy.int64, len(amounts))
+
+        # One stable sort by address gives the groups, their totals (summed
+        # exactly as integers) and the group of every row
+        addr = numpy.array(addresses)
+        order = numpy.argsort(addr, kind='mergesort')
+        sorted_addr = addr[order]
+        starts = numpy.concatenate(
+            ([0], numpy.flatnonzero(sorted_addr[1:] != sorted_addr[:-1]) + 1))
+        uniq = sorted_addr[starts]
+        totals = numpy.add.reduceat(units[order], starts)
+        counts = numpy.diff(numpy.append(starts, len(addr)))
+        group = numpy.empty(len(addr), numpy.intp)
+        group[order] = numpy.repeat(numpy.arange(len(starts)), counts)
+
+        # Drop dust, then rank the rest largest first. uniq is sorted, so the
+        # stable sort breaks ties by address
+        minimum = to_base_units(repr(minimum_tx_output))
+        payable = numpy.flatnonzero(totals >= minimum)
+        ranked = payable[numpy.argsort(-totals[payable], kind='mergesort')]
+        chosen = ranked[:payout_output_limit]
+        dropped = numpy.concatenate((numpy.flatnonzero(totals < minimum),
+                                     ranked[payout_output_limit:]))
+
+        selected = numpy.zeros(len(uniq), dtype=bool)
+        selected[chosen] = True
+        paid = numpy.flatnonzero(selected[group])
+        return cls(uniq[chosen].tolist(), totals[chosen].tolist(),
+                   counts[chosen].tolist(),
+                   pids=[pids[i] for i in paid.tolist()],
+                   dropped=izip(uniq[dropped].tolist(), totals[dropped].tolist()))
+
+    @classmethod
+    def _from_rows_array(cls, pids, addresses, amounts, minimum_tx_output,
+                         payout_output_limit):
+        index = {}
+        group = array('l', [index.setdefault(address, len(index))
+                            for address in addresses])
+        uniq = sorted(index, key=index.get)
+        totals = array('l', [0]) * len(uniq)
+        counts = array('l', [0]) * len(uniq)
+        for g, amount in izip(group, amounts):
+            totals[g] += to_base_units(amount)
+            counts[g] += 1
+
+        minimum = to_base_units(repr(minimum_tx_output))
+        chosen, dropped = _rank(uniq, totals, minimum, payout_output_limit)
+
+        selected = bytearray(len(uniq))
+        for i in chosen:
+            selected[i] = 1
+        return cls([uniq[i] for i in chosen], [totals[i] for i in chosen],
+                   [counts[i] for i in chosen],
+                   pids=[pid for pid, g in izip(pids, group) if selected[g]],
+                   dropped=[(uniq[i], totals[i]) for i in dropped])
+
+
+def _float_safe(text):
+    """ Whether every string in the NumPy string array text is a plain
+    decimal that converts to base units exactly through a float64. Anything
+    else, like more than 8 decimals or an exponent, has to go through
+    to_base_units to round the same way """
+    # One row of character codes per amount, padded with zeros
+    chars = text.view('u1' if text.dtype.kind == 'S' else 'u4').reshape(
+        len(text), -1)
+    if (chars == ord('e')).any() or (chars == ord('E')).any():
+        return False
+    length = (chars != 0).sum(axis=1)
+    is_point = chars == ord('.')
+    point = numpy.where(is_point.any(axis=1), is_point.argmax(axis=1), length)
+    return bool((point <= FLOAT_SAFE_DIGITS).all() and
+                (length - point <= 9).all())
+
+
+def _rank(addresses, totals, minimum, limit):
+    """ Indexes of the outputs to pay, largest first (ties by address), and
+    of those dropped as dust or past the limit """
+    payable = [i for i in xrange(len(totals)) if totals[i] >= minimum]
+    payable.sort(key=lambda i: (-totals[i], addresses[i]))
+    dust = [i for i in xrange(len(totals)) if totals[i] < minimum]
+    return payable[:limit], dust + payable[limit:]
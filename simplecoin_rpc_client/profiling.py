@@ -0,0 +1,98 @@
+import cProfile
+import datetime
+import json
+import os
+import time
+
+
+class Span(object):
+    """ Context manager that adds the wall time spent inside it to a named
+    bucket on its SpanTimer """
+    __slots__ = ['timer', 'key', 'start']
+
+    def __init__(self, timer, key):
+        self.timer = timer
+        self.key = key
+
+    def __enter__(self):
+        self.start = time.time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        elapsed = time.time() - self.start
+        self.timer.spans[self.key] = self.timer.spans.get(self.key, 0.0) + elapsed
+        self.timer.counts[self.key] = self.timer.counts.get(self.key, 0) + 1
+
+
+class NullSpan(object):
+    """ Does nothing. Handed out when profiling is disabled so instrumented
+    code pays for little more than an attribute lookup """
+    __slots__ = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        pass
+
+
+class NullTimer(object):
+    active = False
+    span_obj = NullSpan()
+
+    def span(self, key):
+        return self.span_obj
+
+NULL_TIMER = NullTimer()
+
+
+class SpanTimer(object):
+    """ Records timing spans (db, sc_http, coin_rpc, serialize, etc) for a
+    single job run and optionally a cProfile of the whole run """
+    active = True
+
+    def __init__(self, job, currency_code, profile_path=None):
+        self.job = job
+        self.currency_code = currency_code
+        self.profile_path = profile_path
+        self.spans = {}
+        self.counts = {}
+        self.start_time = None
+        self.total = None
+        self.profiler = None
+
+    def span(self, key):
+        return Span(self, key)
+
+    def start(self):
+        self.start_time = time.time()
+        if self.profile_path:
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+
+    def stop(self):
+        """ Stops timing and dumps the pstats output, returning the path it
+        was written to (or None) """
+        self.total = time.time() - self.start_time
+        if not self.profiler:
+            return
+        self.profiler.disable()
+        if not os.path.isdir(self.profile_path):
+            os.makedirs(self.profile_path)
+        path = os.path.join(
+            self.profile_path, "{}_{}_{}.pstats".format(
+                self.currency_code, self.job,
+                datetime.datetime.utcnow().strftime("%Y%m%d-%H%M%S")))
+        self.profiler.dump_stats(path)
+        return path
+
+    def summary(self):
+        """ A single structured line summarizing where the run spent its
+        time. Time not covered by a span is reported as 'other' """
+        data = dict(job=self.job,
+                    currency=self.currency_code,
+                    total=round(self.total, 6),
+                    other=round(self.total - sum(self.spans.values()), 6),
+                    spans={k: round(v, 6) for k, v in self.spans.iteritems()},
+                    counts=self.counts)
+        return json.dumps(data, sort_keys=True)
@@ -0,0 +1,373 @@
+"""
+Record-and-replay of SC and coin daemon traffic.
+
+With `record_path` set in the sc_rpc_client config every response seen by
+SCRPCClient.remote and every coin_rpc call is appended to
+`{record_path}/{currency_code}.jsonl`. The replay entry point then runs
+PayoutManager against those recordings, driving the scheduler's jobs from a
+virtual clock so a full day of production traffic can be replayed offline in
+a fraction of the time.
+
+    python -m simplecoin_rpc_client.replay -cl /config.yml -r recordings/ -s 0
+"""
+import argparse
+import datetime
+import json
+import logging
+import os
+import sys
+import tempfile
+import threading
+import time
+import yaml
+
+from collections import deque
+from decimal import Decimal
+from itsdangerous import TimedSerializer, TimestampSigner, EPOCH
+from cryptokit.rpc import CoinRPCException
+
+
+logger = logging.getLogger('apscheduler.scheduler')
+os_root = os.path.abspath(os.path.dirname(__file__) + '/../')
+
+
+########################################################################
+# Encoding of coin_rpc results
+########################################################################
+class ReplayObject(object):
+    """ Stands in for the objects returned by CoinRPC (transactions, etc) """
+    def __init__(self, **attrs):
+        self.__dict__.update(attrs)
+
+
+def encode(obj):
+    if isinstance(obj, tuple):
+        return {'__tuple__': [encode(o) for o in obj]}
+    if isinstance(obj, list):
+        return [encode(o) for o in obj]
+    if isinstance(obj, dict):
+        return {k: encode(v) for k, v in obj.iteritems()}
+    if isinstance(obj, Decimal):
+        return {'__decimal__': str(obj)}
+    if isinstance(obj, datetime.datetime):
+        return {'__datetime__': obj.isoformat()}
+    if hasattr(obj, '__dict__'):
+        return {'__obj__': {k: encode(v) for k, v in vars(obj).iteritems()
+                            if not k.startswith('_')}}
+    return obj
+
+
+def decode(obj):
+    if isinstance(obj, list):
+        return [decode(o) for o in obj]
+    if isinstance(obj, dict):
+        if '__tuple__' in obj:
+            return tuple(decode(o) for o in obj['__tuple__'])
+        if '__decimal__' in obj:
+            return Decimal(obj['__decimal__'])
+        if '__datetime__' in obj:
+            return datetime.datetime.strptime(obj['__datetime__'][:19],
+                                              "%Y-%m-%dT%H:%M:%S")
+        if '__obj__' in obj:
+            return ReplayObject(**{str(k): decode(v)
+                                   for k, v in obj['__obj__'].iteritems()})
+        return {k: decode(v) for k, v in obj.iteritems()}
+    return obj
+
+
+########################################################################
+# Recording
+########################################################################
+class Recorder(object):
+    """ Appends captured traffic for one currency to a JSON lines file """
+    def __init__(self, record_path, currency_code):
+        if not os.path.isdir(record_path):
+            os.makedirs(record_path)
+        self.path = os.path.join(record_path, currency_code + '.jsonl')
+        self.lock = threading.Lock()
+
+    def write(self, kind, **data):
+        data['kind'] = kind
+        data['t'] = time.time()
+        line = json.dumps(data) + "\n"
+        with self.lock:
+            with open(self.path, 'a') as f:
+                f.write(line)
+
+    def record_sc(self, url, method, response):
+        self.write('sc', url=url, method=method,
+                   status_code=response.status_code, text=response.text)
+
+    def record_coin_rpc(self, name, args, result=None, error=None):
+        self.write('coin_rpc', name=name, args=encode(list(args)),
+                   result=encode(result), error=error)
+
+
+class RecordingCoinRPC(object):
+    """ Wraps a CoinRPC, recording the result of every method call """
+    def __init__(self, coin_rpc, recorder):
+        self._coin_rpc = coin_rpc
+        self._recorder = recorder
+        # Never record credentials
+        self._recorder.write('meta', coinserv={
+            'account': coin_rpc.coinserv.get('account')})
+
+    def __getattr__(self, name):
+        attr = getattr(self._coin_rpc, name)
+        if not callable(attr):
+            return attr
+
+        def wrapped(*args):
+            try:
+                res = attr(*args)
+            except CoinRPCException as e:
+                self._recorder.record_coin_rpc(name, args, error=str(e))
+                raise
+            self._recorder.record_coin_rpc(name, args, result=res)
+            return res
+        return wrapped
+
+
+########################################################################
+# Replay
+########################################################################
+class VirtualClock(object):
+    def __init__(self, start):
+        self.now = start
+
+    def time(self):
+        return self.now
+
+    def utcnow(self):
+        return datetime.datetime.utcfromtimestamp(self.now)
+
+
+class ReplayResponse(object):
+    def __init__(self, status_code, text):
+        self.status_code = status_code
+        self.text = text
+
+    def json(self):
+        return json.loads(self.text)
+
+
+class ReplayHTTP(object):
+    """ Replaces the requests module on an SCRPCClient, handing back recorded
+    SC responses in the order they were captured for each url """
+    def __init__(self, responses):
+        self.responses = {}
+        for rec in responses:
+            self.responses.setdefault((rec['method'], rec['url']), []).append(rec)
+        for queue in self.responses.itervalues():
+            queue.reverse()
+
+    def _respond(self, method, url, **kwargs):
+        queue = self.responses.get((method, url))
+        if not queue:
+            from simplecoin_rpc_client.sc_rpc import SCRPCException
+            raise SCRPCException("No recorded {} response left for {}"
+                                 .format(method, url))
+        rec = queue.pop()
+        return ReplayResponse(rec['status_code'], rec['text'])
+
+    def get(self, url, **kwargs):
+        return self._respond('get', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self._respond('post', url, **kwargs)
+
+
+class ReplayCoinRPC(object):
+    """ Answers coin_rpc calls from a recording. Calls are matched on method
+    name and arguments, falling back to method name alone """
+    def __init__(self, calls, coinserv):
+        self.coinserv = coinserv
+        self.by_args = {}
+        self.by_name = {}
+        for rec in calls:
+            rec['used'] = False
+            key = (rec['name'], json.dumps(rec['args']))
+            self.by_args.setdefault(key, deque()).append(rec)
+            self.by_name.setdefault(rec['name'], deque()).append(rec)
+
+    def _next(self, queue):
+        while queue and queue[0]['used']:
+            queue.popleft()
+        return queue[0] if queue else None
+
+    def _pop(self, name, args):
+        key = (name, json.dumps(encode(list(args))))
+        rec = (self._next(self.by_args.get(key, ())) or
+               self._next(self.by_name.get(name, ())))
+        if rec is None:
+            raise CoinRPCException("No recorded response for {}{}"
+                                   .format(name, args))
+        rec['used'] = True
+        if rec['error'] is not None:
+            raise CoinRPCException(rec['error'])
+        return decode(rec['result'])
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return lambda *args: self._pop(name, args)
+
+
+def virtual_serializer(secret_key, clock):
+    """ A TimedSerializer whose notion of now comes from the virtual clock,
+    so recorded signatures are still inside max_age when replayed """
+    class VirtualTimestampSigner(TimestampSigner):
+        def get_timestamp(self):
+            # itsdangerous counts from its own epoch, not the unix one
+            return int(clock.time() - EPOCH)
+    return TimedSerializer(secret_key, signer=VirtualTimestampSigner)
+
+
+def load_recording(path):
+    meta = {}
+    sc = []
+    calls = []
+    with open(path) as f:
+        for line in f:
+            rec = json.loads(line)
+            if rec['kind'] == 'meta':
+                meta = rec
+            elif rec['kind'] == 'sc':
+                sc.append(rec)
+            elif rec['kind'] == 'coin_rpc':
+                calls.append(rec)
+    return meta, sc, calls
+
+
+class Replayer(object):
+    """ Fires the scheduler's jobs on a virtual clock between `start` and
+    `end` (unix timestamps), sleeping (virtual time / speed) between jobs.
+    A speed of 0 runs the jobs back to back as fast as possible. """
+    def __init__(self, jobs, clock, end, speed=0):
+        self.jobs = jobs
+        self.clock = clock
+        self.end = end
+        self.speed = speed
+        self.stats = {}
+
+    def run(self):
+        triggers = dict((func, trigger) for name, func, trigger in self.jobs)
+        names = dict((func, name) for name, func, trigger in self.jobs)
+        next_fire = {}
+        for func, trigger in triggers.iteritems():
+            next_fire[func] = trigger.get_next_fire_time(self.clock.utcnow())
+
+        wall_start = time.time()
+        virtual_start = self.clock.time()
+        while True:
+            func, fire_time = min(((f, t) for f, t in next_fire.iteritems() if t),
+                                  key=lambda x: x[1])
+            fire_ts = (fire_time - datetime.datetime(1970, 1, 1)).total_seconds()
+            if fire_ts > self.end:
+                break
+            if self.speed:
+                time.sleep(max(0, fire_ts - self.clock.time()) / self.speed)
+            self.clock.now = fire_ts
+
+            t = time.time()
+            func()
+            elapsed = time.time() - t
+            stats = self.stats.setdefault(names[func], [0, 0.0, 0.0])
+            stats[0] += 1
+            stats[1] += elapsed
+            stats[2] = max(stats[2], elapsed)
+
+            next_fire[func] = triggers[func].get_next_fire_time(
+                fire_time + datetime.timedelta(seconds=1))
+
+        return time.time() - wall_start, self.clock.time() - virtual_start
+
+    def summary(self, wall, virtual):
+        lines = ["Replayed {:,.0f} virtual seconds in {:,.2f} wall seconds ({:,.1f}x)"
+                 .format(virtual, wall, virtual / wall if wall else 0)]
+        for name, (count, total, worst) in sorted(self.stats.iteritems()):
+            lines.append("{}: {:,} runs, {:,.4f}s total, {:,.4f}s mean, {:,.4f}s max"
+                         .format(name, count, total, total / count, worst))
+        return "\n".join(lines)
+
+
+def replay(cfg, recordings_path, db_dir, speed=0):
+    """ Replays the recordings in recordings_path against fresh databases in
+    db_dir. Returns the Replayer and PayoutManager used along with the wall
+    and virtual seconds taken, or None if there was nothing to replay """
+    from simplecoin_rpc_client.sc_rpc import SCRPCClient
+    from simplecoin_rpc_client.scheduler import PayoutManager, job_triggers
+
+    recordings = {}
+    for curr_cfg in cfg['currencies']:
+        path = os.path.join(recordings_path, curr_cfg['currency_code'] + '.jsonl')
+        if curr_cfg['enabled'] and os.path.exists(path):
+            recordings[curr_cfg['currency_code']] = load_recording(path)
+
+    times = [rec['t'] for meta, sc, calls in recordings.itervalues()
+             for rec in sc + calls]
+    if not times:
+        logger.error("No recordings found in {}".format(recordings_path))
+        return
+    clock = VirtualClock(min(times))
+
+    coin_rpc = {}
+    sc_rpc = {}
+    for curr_cfg in cfg['currencies']:
+        cc = curr_cfg['currency_code']
+        if cc not in recordings:
+            continue
+        meta, sc, calls = recordings[cc]
+        coin_rpc[cc] = ReplayCoinRPC(calls, meta.get('coinserv', {}))
+
+        curr_cfg.update(cfg['sc_rpc_client'])
+        curr_cfg.update(database_path=os.path.join(db_dir, 'rpc_'),
+                        log_path=None, record_path=None)
+        sc_rpc[cc] = SCRPCClient(curr_cfg, coin_rpc[cc], logger=logger)
+        sc_rpc[cc].http = ReplayHTTP(sc)
+        sc_rpc[cc].serializer = virtual_serializer(curr_cfg['rpc_signature'], clock)
+        sc_rpc[cc].utcnow = clock.utcnow
+
+    pm = PayoutManager(logger, sc_rpc, coin_rpc, clock=clock.time)
+    jobs = job_triggers(pm, cfg, start_date=clock.utcnow())
+    replayer = Replayer(jobs, clock, max(times), speed=speed)
+    wall, virtual = replayer.run()
+    return replayer, pm, wall, virtual
+
+
+def entry():
+    parser = argparse.ArgumentParser(prog='simplecoin rpc client replay')
+    parser.add_argument('-l', '--log-level',
+                        choices=['DEBUG', 'INFO', 'WARN', 'ERROR'],
+                        default='WARN')
+    parser.add_argument('-cl', '--config-location',
+                        default='/config.yml')
+    parser.add_argument('-r', '--recordings', required=True,
+                        help='directory of recorded {currency}.jsonl files')
+    parser.add_argument('-s', '--speed', type=float, default=0,
+                        help='virtual seconds per wall second, 0 for unlimited')
+    parser.add_argument('-d', '--database-dir', default=None,
+                        help='where to put the replay databases. Defaults to '
+                             'a new temporary directory')
+    args = parser.parse_args()
+
+    root = logging.getLogger()
+    hdlr = logging.StreamHandler(stream=sys.stdout)
+    formatter = logging.Formatter('%(asctime)s [%(name)s] [%(levelname)s] %(message)s')
+    hdlr.setFormatter(formatter)
+    root.addHandler(hdlr)
+    root.setLevel(getattr(logging, args.log_level))
+
+    cfg = yaml.load(open(os_root + args.config_location))
+    db_dir = args.database_dir or tempfile.mkdtemp(prefix='sc_rpc_replay')
+
+    res = replay(cfg, args.recordings, db_dir, speed=args.speed)
+    if res is None:
+        return
+    replayer, pm, wall, virtual = res
+    print(replayer.summary(wall, virtual))
+    print("Replay databases left in {}".format(db_dir))
+
+
+if __name__ == "__main__":
+    entry()
@@ -1,10 +1,12 @@
 import logging
 from pprint import pformat
+from collections import OrderedDict
 import sys
 import yaml
 import os
 import argparse
 import datetime
+import json
 import requests
 import sqlalchemy as sa
 import decorator
@@ -12,72 +14,67 @@ import decorator
 from cryptokit.rpc import CoinRPCException
 from urllib3.exceptions import ConnectionError
 from tabulate import tabulate
-from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 
 from urlparse import urljoin
 from cryptokit.base58 import get_bcaddress_version
 from itsdangerous import TimedSerializer, BadData
-
-
-base = declarative_base()
+from simplecoin_rpc_client.models import Payout, OutboxMessage
+from simplecoin_rpc_client.plan import PayoutPlan
+from simplecoin_rpc_client.profiling import SpanTimer, NULL_TIMER
+from simplecoin_rpc_client.storage import storages, to_base_units, COIN
+from simplecoin_rpc_client.replay import Recorder, RecordingCoinRPC
 
 
 @decorator.decorator
 def crontab(func, *args, **kwargs):
     """ Handles rolling back SQLAlchemy exceptions to prevent breaking the
-    connection for the whole scheduler. Also records timing information into
-    the cache """
+    connection for the whole scheduler. Each outermost call runs in its own
+    session so nothing loaded by one job outlives it. When profiling is enabled
+    also records timing spans and cProfile output for the run. An exception
+    swallowed here is left in self.last_error until the next outermost call """
     self = args[0]
 
+    # Don't start a new run if we're nested inside another crontab method
+    outermost = self._job_depth == 0
+    if outermost:
+        self.last_error = None
+    self._job_depth += 1
+    timer = None
+    if self.config['profile'] and outermost:
+        timer = self.timer = SpanTimer(func.__name__,
+                                       self.config['currency_code'],
+                                       profile_path=self.config['profile_path'])
+        timer.start()
+
     res = None
     try:
         res = func(*args, **kwargs)
-    except sa.exc.SQLAlchemyError:
+    except sa.exc.SQLAlchemyError as e:
         self.logger.error("SQLAlchemyError occurred, rolling back", exc_info=True)
-        self.db.session.rollback()
-    except Exception:
+        self.storage.rollback()
+        self.last_error = e
+    except Exception as e:
         self.logger.error("Unhandled exception in {}".format(func.__name__),
                           exc_info=True)
+        self.last_error = e
+    finally:
+        self._job_depth -= 1
+        if outermost:
+            # Anything the job didn't commit is discarded with its session
+            self.storage.rollback()
+            self._new_session()
+        if timer:
+            self.timer = NULL_TIMER
+            path = timer.stop()
+            self.logger.info("Run summary: {}".format(timer.summary()))
+            if path:
+                self.logger.info("Wrote profile for {} to {}"
+                                 .format(func.__name__, path))
 
     return res
 
 
-class Payout(base):
-    """ Our single table in the sqlite database. Handles tracking the status of
-    payouts and keeps track of tasks that needs to be retried, etc. """
-    __tablename__ = "payouts"
-    id = sa.Column(sa.Integer, primary_key=True)
-    pid = sa.Column(sa.String, unique=True, nullable=False)
-    user = sa.Column(sa.String, nullable=False)
-    address = sa.Column(sa.String, nullable=False)
-    # SQLlite does not have support for Decimal - use STR instead
-    amount = sa.Column(sa.String, nullable=False)
-    currency_code = sa.Column(sa.String, nullable=False)
-    txid = sa.Column(sa.String)
-    associated = sa.Column(sa.Boolean, default=False, nullable=False)
-    locked = sa.Column(sa.Boolean, default=False, nullable=False)
-
-    # Times
-    lock_time = sa.Column(sa.DateTime)
-    paid_time = sa.Column(sa.DateTime)
-    assoc_time = sa.Column(sa.DateTime)
-    pull_time = sa.Column(sa.DateTime)
-
-    @property
-    def trans_id(self):
-        if self.txid is None:
-            return "NULL"
-        return self.txid
-
-    @property
-    def amount_float(self):
-        return float(self.amount)
-
-    def tabulize(self, columns):
-        return [getattr(self, a) for a in columns]
-
-
 class SCRPCException(Exception):
     pass
 
@@ -92,7 +89,35 @@ class SCRPCClient(object):
                            database_path=base + '/rpc_',
                            log_path=base + '/sc_rpc.log',
                            min_confirms=12,
-                           minimum_tx_output=0.00000001)
+                           minimum_tx_output=0.00000001,
+                           trade_request_batch_size=500,
+                           profile=False,
+                           profile_path=base + '/profiles/',
+                           outbox_batch_size=100,
+                           outbox_backoff=10,
+                           outbox_max_backoff=3600,
+                           record_path=None,
+                           storage='sqlite',
+                           pull_interval=60,
+                           min_pull_interval=10,
+                           max_pull_interval=300,
+                           payout_cron={'hour': '23'},
+                           associate_cron={'hour': '0'},
+                           confirm_cron={'hour': '1'},
+                           payout_mode='nightly',
+                           payout_min_total=None,
+                           payout_min_addresses=None,
+                           payout_max_age=None,
+                           payout_min_spacing=600,
+                           payout_check_interval=60,
+                           reconcile_page_size=1000,
+                           reconcile_slack=300,
+                           combined_pull=False,
+                           combined_pull_retry=3600,
+                           sqlite_pragmas={'journal_mode': 'WAL',
+                                           'synchronous': 'FULL',
+                                           'temp_store': 'MEMORY',
+                                           'cache_size': -16000})
         self.config.update(kwargs)
 
         # Kinda sloppy, but it works
@@ -106,6 +131,14 @@ class SCRPCClient(object):
                 print("{} is a required configuration variable".format(req))
                 error = True
 
+        if self.config['payout_mode'] not in ('nightly', 'continuous'):
+            print("payout_mode must be nightly or continuous")
+            error = True
+
+        if self.config['storage'] not in storages:
+            print("storage must be one of {}".format(", ".join(storages)))
+            error = True
+
         if error:
             raise SCRPCException('Errors occurred while configuring RPCClient obj')
 
@@ -117,10 +150,22 @@ class SCRPCClient(object):
 
         # Setup CoinRPC
         self.coin_rpc = CoinRPC
-
-        # Setup the sqlite database mapper
-        self.engine = sa.create_engine('sqlite:///{}'.format(self.config['database_path']),
-                                       echo=self.config['log_level'] == "DEBUG")
+        # Where every timestamp the client records or compares comes from.
+        # Replay swaps in its virtual clock
+        self.utcnow = datetime.datetime.utcnow
+        # Timing spans for the current job run. A no-op unless profiling
+        self.timer = NULL_TIMER
+
+        # Setup the sqlite database mapper. The memory storage engine still
+        # keeps the outbox in an in-memory sqlite database shared by all threads
+        if self.config['storage'] == 'memory':
+            self.engine = sa.create_engine('sqlite://',
+                                           poolclass=sa.pool.StaticPool,
+                                           connect_args={'check_same_thread': False},
+                                           echo=self.config['log_level'] == "DEBUG")
+        else:
+            self.engine = sa.create_engine('sqlite:///{}'.format(self.config['database_path']),
+                                           echo=self.config['log_level'] == "DEBUG")
 
         # Pulled from SQLA docs to implement strict exclusive access to the
         # payout state database.
@@ -130,6 +175,9 @@ class SCRPCClient(object):
             # disable pysqlite's emitting of the BEGIN statement entirely.
             # also stops it from emitting COMMIT before any DDL.
             dbapi_connection.isolation_level = None
+            if self.config['storage'] == 'sqlite':
+                for pragma, value in self.config['sqlite_pragmas'].iteritems():
+                    dbapi_connection.execute("PRAGMA {} = {}".format(pragma, value))
 
         @sa.event.listens_for(self.engine, "begin")
         def do_begin(conn):
@@ -137,11 +185,19 @@ class SCRPCClient(object):
             conn.execute("BEGIN EXCLUSIVE")
 
         self.db = sessionmaker(bind=self.engine)
-        self.db.session = self.db()
-        # Hack if flask is in the env
-        self.db.session._model_changes = {}
-        # Create the table if it doesn't exist
-        Payout.__table__.create(self.engine, checkfirst=True)
+        self.db.session = None
+        self._new_session()
+        # How many crontab methods deep we are. Sessions are replaced when the
+        # outermost one returns
+        self._job_depth = 0
+        # The exception that failed the last crontab run, if any
+        self.last_error = None
+        # All payout persistence goes through the storage engine
+        self.storage = storages[self.config['storage']](
+            self.db, self.config['currency_code'])
+        # Create the tables if they don't exist
+        self.storage.setup(self.engine)
+        OutboxMessage.__table__.create(self.engine, checkfirst=True)
 
         # Setup logger for the class
         if logger:
@@ -166,6 +222,37 @@ class SCRPCClient(object):
                 self.logger.addHandler(handler)
 
         self.serializer = TimedSerializer(self.config['rpc_signature'])
+        # Swapped out by the replay harness
+        self.http = requests
+
+        # Capture SC and coin daemon traffic for later replay
+        self.recorder = None
+        if self.config['record_path']:
+            self.recorder = Recorder(self.config['record_path'],
+                                     self.config['currency_code'])
+            self.coin_rpc = RecordingCoinRPC(self.coin_rpc, self.recorder)
+        # Open trade requests keyed by currency then type. Populated by
+        # get_open_trade_requests
+        self.trade_requests = {}
+        # When we last tried to send a payout transaction. Loaded from the
+        # database the first time payout_due needs it
+        self.last_payout_attempt = None
+        # Set by payout_due while continuous payouts are held back by payouts
+        # left locked by a failed payout
+        self.payouts_suspended = False
+
+    def _new_session(self):
+        """ Closes the current session, releasing its connection and
+        everything in its identity map, and starts a fresh one """
+        if self.db.session is not None:
+            self.db.session.close()
+        self.db.session = self.db()
+        # Hack if flask is in the env
+        self.db.session._model_changes = {}
+
+    def span(self, key):
+        """ Times the enclosed block under the given key when profiling """
+        return self.timer.span(key)
 
     ########################################################################
     # Helper URL methods
@@ -173,7 +260,8 @@ class SCRPCClient(object):
     def post(self, url, *args, **kwargs):
         if 'data' not in kwargs:
             kwargs['data'] = ''
-        kwargs['data'] = self.serializer.dumps(kwargs['data'])
+        with self.span('serialize'):
+            kwargs['data'] = self.serializer.dumps(kwargs['data'])
         return self.remote('/rpc/' + url, 'post', *args, **kwargs)
 
     def get(self, url, *args, **kwargs):
@@ -182,16 +270,20 @@ class SCRPCClient(object):
     def remote(self, url, method, max_age=None, signed=True, **kwargs):
         url = urljoin(self.config['rpc_url'], url)
         self.logger.debug("Making request to {}".format(url))
-        ret = getattr(requests, method)(url, timeout=270, **kwargs)
+        with self.span('sc_http'):
+            ret = getattr(self.http, method)(url, timeout=270, **kwargs)
+        if self.recorder:
+            self.recorder.record_sc(url, method, ret)
         if ret.status_code != 200:
             raise SCRPCException("Non 200 from remote: {}".format(ret.text))
 
         try:
             self.logger.debug("Got {} from remote".format(ret.text.encode('utf8')))
-            if signed:
-                return self.serializer.loads(ret.text, max_age or self.config['max_age'])
-            else:
-                return ret.json()
+            with self.span('serialize'):
+                if signed:
+                    return self.serializer.loads(ret.text, max_age or self.config['max_age'])
+                else:
+                    return ret.json()
         except BadData:
             self.logger.error("Invalid data returned from remote!", exc_info=True)
             raise SCRPCException("Invalid signature")
@@ -201,7 +293,8 @@ class SCRPCClient(object):
     ########################################################################
     @crontab
     def pull_payouts(self, simulate=False):
-        """ Gets all the unpaid payouts from the server """
+        """ Gets all the unpaid payouts from the server. Returns the number of
+        new payouts stored, or None if SC couldn't be reached """
 
         if simulate:
             self.logger.info('#'*20 + ' Simulation mode ' + '#'*20)
@@ -215,14 +308,40 @@ class SCRPCClient(object):
             self.logger.warn('Unable to connect to SC!', exc_info=True)
             return
 
+        return self.store_payouts(payouts, simulate=simulate)
+
+    def get_combined_payouts(self, currencies):
+        """ Gets the unpaid payouts for several currencies served by the same
+        SC in a single request. Returns a dictionary of currency_code -> list
+        of payouts. Raises SCRPCException if SC doesn't support combined
+        pulls """
+        res = self.post('get_payouts', data={'currencies': currencies})
+        if 'pids' not in res:
+            raise SCRPCException("SC doesn't support combined pulls")
+        payouts = dict((currency, []) for currency in currencies)
+        for row in res['pids']:
+            if len(row) != 5:
+                raise SCRPCException("SC doesn't support combined pulls")
+            user, address, amount, pid, currency = row
+            if currency not in payouts:
+                self.logger.warn("Ignoring payout {} for currency {} that "
+                                 "wasn't requested".format(pid, currency))
+                continue
+            payouts[currency].append((user, address, amount, pid))
+        return payouts
+
+    @crontab
+    def store_payouts(self, payouts, simulate=False):
+        """ Validates and stores payouts pulled from SC, given as (user,
+        address, amount, pid). Returns the number of new payouts stored """
         if not payouts:
             self.logger.info("No {} payouts to process.."
                              .format(self.config['currency_code']))
-            return
+            return 0
 
-        repeat = 0
-        new = 0
         invalid = 0
+        now = self.utcnow()
+        valid = []
         for user, address, amount, pid in payouts:
             # Check address is valid
             if not get_bcaddress_version(address) in self.config['valid_address_versions']:
@@ -233,27 +352,23 @@ class SCRPCClient(object):
                                          self.config['valid_address_versions']))
                 invalid += 1
                 continue
-            # Check payout doesn't already exist
-            if self.db.session.query(Payout).filter_by(pid=pid).first():
-                self.logger.debug("Ignoring payout {} because it already exists"
-                                  " locally".format((user, address, amount, pid)))
-                repeat += 1
-                continue
-            # Create local payout obj
-            p = Payout(pid=pid, user=user, address=address, amount=amount,
-                       currency_code=self.config['currency_code'],
-                       pull_time=datetime.datetime.utcnow())
-            new += 1
+            valid.append(dict(pid=pid, user=user, address=address,
+                              amount=amount, pull_time=now,
+                              currency_code=self.config['currency_code']))
 
+        # Payouts that already exist locally are skipped by the storage engine
+        with self.span('db'):
+            new = self.storage.insert_payouts(valid)
             if not simulate:
-                self.db.session.add(p)
-
-        self.db.session.commit()
+                self.storage.commit()
+            else:
+                self.storage.rollback()
+        repeat = len(valid) - new
 
         self.logger.info("Inserted {:,} new {} payouts and skipped {:,} old "
                          "payouts from the server. {:,} payouts with invalid addresses."
                          .format(new, self.config['currency_code'], repeat, invalid))
-        return True
+        return new
 
     @crontab
     def send_payout(self, simulate=False, payout_output_limit=10000):
@@ -263,7 +378,8 @@ class SCRPCClient(object):
             self.logger.info('#'*20 + ' Simulation mode ' + '#'*20)
 
         try:
-            self.coin_rpc.poke_rpc()
+            with self.span('coin_rpc'):
+                self.coin_rpc.poke_rpc()
         except CoinRPCException as e:
             self.logger.warn(
                 "Error occured while trying to get info from the {} RPC. Got "
@@ -272,55 +388,31 @@ class SCRPCClient(object):
 
         # Grab all payouts now so that we use the same list of payouts for both
         # database transactions (locking, and unlocking)
-        payouts = (self.db.session.query(Payout).
-                   filter_by(txid=None,
-                             locked=False,
-                             currency_code=self.config['currency_code'])
-                   .all())
+        with self.span('db'):
+            pids, addresses, amounts = self.storage.unpaid_columns()
 
-        if not payouts:
+        if not pids:
             self.logger.info("No payouts to process, exiting")
             return True
 
-        # track the total payouts to each address
-        address_payout_amounts = {}
-        pids = {}
-        for payout in payouts:
-            address_payout_amounts.setdefault(payout.address, 0.0)
-            address_payout_amounts[payout.address] += float(payout.amount)
-            pids.setdefault(payout.address, [])
-            pids[payout.address].append(payout.pid)
-
-            # We'll lock the payout before continuing in case of a failure in
-            # between paying out and recording that payout action
-            payout.locked = True
-            payout.lock_time = datetime.datetime.utcnow()
-
-        for i, (address, amount) in enumerate(address_payout_amounts.items()):
-            # Convert amount from STR and coerce to a payable value.
-            # Note that we're not trying to validate the amount here, all
-            # validation should be handled server side.
-            amount = round(float(amount), 8)
-            if amount < self.config['minimum_tx_output'] or i > payout_output_limit:
-                # We're unable to pay, so undo the changes from the last loop
-                self.logger.warn('Removing {} with payout amount of {} (which '
-                                 'is lower than network output min of {}) from '
-                                 'the {} payout dictionary'
-                                 .format(address, amount,
-                                         self.config['minimum_tx_output'],
-                                         self.config['currency_code']))
-
-                address_payout_amounts.pop(address)
-                pids[address] = []
-                for payout in payouts:
-                    if payout.address == address:
-                        payout.locked = False
-                        payout.lock_time = None
-            else:
-                address_payout_amounts[address] = amount
+        with self.span('aggregate'):
+            plan = PayoutPlan.from_rows(pids, addresses, amounts,
+                                        self.config['minimum_tx_output'],
+                                        payout_output_limit)
+        self._log_dropped(plan)
+        address_payout_amounts = plan.amounts
+        paid_pids = plan.pids
+
+        # We'll lock the payouts before continuing in case of a failure in
+        # between paying out and recording that payout action
+        with self.span('db'):
+            self.storage.lock(paid_pids, self.utcnow())
+        if not simulate:
+            self.last_payout_attempt = self.utcnow()
 
-        total_out = sum(address_payout_amounts.values())
-        balance = self.coin_rpc.get_balance(self.coin_rpc.coinserv['account'])
+        total_out = plan.total_amount
+        with self.span('coin_rpc'):
+            balance = self.coin_rpc.get_balance(self.coin_rpc.coinserv['account'])
         self.logger.info("Account balance for {} account \'{}\': {:,}"
                          .format(self.config['currency_code'],
                                  self.coin_rpc.coinserv['account'], balance))
@@ -328,30 +420,26 @@ class SCRPCClient(object):
 
         if balance < total_out:
             self.logger.error("Payout wallet is out of funds!")
-            self.db.session.rollback()
+            self.storage.rollback()
             # XXX: Add an email call here
             return False
 
         if total_out == 0:
             self.logger.info("Paying out 0 funds! Aborting...")
-            self.db.session.rollback()
+            self.storage.rollback()
             return True
 
-        if not simulate:
-            self.db.session.commit()
-        else:
-            self.db.session.rollback()
+        with self.span('db'):
+            if not simulate:
+                self.storage.commit()
+            else:
+                self.storage.rollback()
 
-        def format_pids(pids):
-            lst = ", ".join(pids[:9])
-            if len(pids) > 9:
-                return lst + "... ({} more)".format(len(pids) - 8)
-            return lst
-        summary = [(str(address), amount, str(format_pids(upids))) for
-                   (address, amount), upids in zip(address_payout_amounts.iteritems(), pids.itervalues())]
+        summary = [(str(address), amount, plan.counts[address]) for
+                   address, amount in address_payout_amounts.iteritems()]
 
         self.logger.info(
-            "Address payment summary\n" + tabulate(summary, headers=["Address", "Total", "Pids"], tablefmt="grid"))
+            "Address payment summary\n" + tabulate(summary, headers=["Address", "Total", "Payouts"], tablefmt="grid"))
 
         try:
             if simulate:
@@ -365,44 +453,191 @@ class SCRPCClient(object):
                     return True
             else:
                 # finally run rpc call to payout
-                coin_txid, rpc_tx_obj = self.coin_rpc.send_many(
-                    self.coin_rpc.coinserv['account'], address_payout_amounts)
+                with self.span('coin_rpc'):
+                    coin_txid, rpc_tx_obj = self.coin_rpc.send_many(
+                        self.coin_rpc.coinserv['account'], address_payout_amounts)
         except CoinRPCException as e:
             self.logger.warn(e)
             new_balance = self.coin_rpc.get_balance(self.coin_rpc.coinserv['account'])
             if new_balance != balance:
                 self.logger.error(
                     "RPC error occured and wallet balance changed! Keeping the "
-                    "payout entries locked. simplecoin_rpc dump_incomplete can "
-                    "show you the details of the locked entries. If you're SURE"
-                    "a double payout hasn't occured, use simplecoin_rpc "
-                    "reset_all_locked to reset the entries.", exc_info=True)
+                    "payout entries locked. simplecoin_rpc reconcile can match "
+                    "them against the wallet's transactions, and "
+                    "dump_incomplete can show you the details of the locked "
+                    "entries. Continuous payouts are suspended until no "
+                    "payouts are left locked.", exc_info=True)
                 return False
             else:
                 self.logger.error("RPC error occured and wallet balance didn't "
                                   "change. Unlocking payouts.")
                 # Reset all the payouts so we can try again later
-                for payout in payouts:
-                    payout.locked = False
-
-                self.db.session.commit()
+                self.storage.unlock(paid_pids)
+                self.storage.commit()
                 return False
         else:
             # Success! Now associate the txid and unlock to allow association
             # with remote to occur
-            payout_addrs = [address for address in address_payout_amounts.iterkeys()]
-            finalized_payouts = []
-            for payout in payouts:
-                if payout.address in payout_addrs:
-                    payout.locked = False
-                    payout.txid = coin_txid
-                    payout.paid_time = datetime.datetime.utcnow()
-                    finalized_payouts.append(payout)
-
-            self.db.session.commit()
+            with self.span('db'):
+                self.storage.set_txid(paid_pids, coin_txid,
+                                      self.utcnow())
+
+            # Queue the association in the same transaction that records the
+            # txid, so SC is guaranteed to hear about it eventually
+            if rpc_tx_obj is not None:
+                self._enqueue_association(coin_txid, paid_pids, rpc_tx_obj.fee)
+
+            with self.span('db'):
+                self.storage.commit()
             self.logger.info("Updated {:,} (local) Payouts with txid {}"
-                             .format(len(finalized_payouts), coin_txid))
-            return coin_txid, rpc_tx_obj, finalized_payouts
+                             .format(len(paid_pids), coin_txid))
+            return coin_txid, rpc_tx_obj, paid_pids
+
+    def _log_dropped(self, plan):
+        """ Payouts to outputs we're unable to pay are left unlocked """
+        if not plan.dropped:
+            return
+        for address, amount in plan.dropped:
+            self.logger.debug("Removing {} with payout amount of {} from the {} "
+                              "payout dictionary".format(
+                                  address, amount, self.config['currency_code']))
+        self.logger.warn("Left {:,} addresses totalling {:,} out of the {} "
+                         "payout, either below the network output min of {} or "
+                         "past the output limit".format(
+                             len(plan.dropped),
+                             sum(amount for address, amount in plan.dropped),
+                             self.config['currency_code'],
+                             self.config['minimum_tx_output']))
+
+    @crontab
+    def preview_payout(self, simulate=False, payout_output_limit=10000):
+        """ Shows what send_payout would pay right now without locking or
+        paying anything. Works from the pending balance table, so it only
+        costs one row per address """
+        with self.span('db'):
+            balances = self.storage.pending_balances()
+
+        plan = PayoutPlan.from_totals(
+            balances.keys(), [amount for amount, count in balances.itervalues()],
+            [count for amount, count in balances.itervalues()],
+            self.config['minimum_tx_output'], payout_output_limit)
+        self._log_dropped(plan)
+        total_out = plan.total_amount
+
+        summary = [(str(address), amount, plan.counts[address])
+                   for address, amount in plan.amounts.iteritems()]
+        self.logger.info(
+            "{} payout preview\n".format(self.config['currency_code']) +
+            tabulate(summary, headers=["Address", "Total", "Payouts"], tablefmt="grid"))
+        self.logger.info("Would pay {:,} to {:,} addresses ({:,} pending "
+                         "addresses in total)"
+                         .format(total_out, len(plan), len(balances)))
+
+        try:
+            with self.span('coin_rpc'):
+                balance = self.coin_rpc.get_balance(self.coin_rpc.coinserv['account'])
+        except CoinRPCException as e:
+            self.logger.warn("Unable to get the {} wallet balance: {}"
+                             .format(self.config['currency_code'], e))
+        else:
+            self.logger.info("Account balance for {} account \'{}\': {:,}"
+                             .format(self.config['currency_code'],
+                                     self.coin_rpc.coinserv['account'], balance))
+            if balance < total_out:
+                self.logger.warn("Payout wallet doesn't have enough funds!")
+
+        return plan
+
+    @crontab
+    def payout_due(self, simulate=False):
+        """ For the continuous payout mode. Returns the reason a payout should
+        be sent now if any of the configured thresholds are met, and the last
+        payout attempt was at least payout_min_spacing seconds ago. Otherwise
+        None """
+        # Locked payouts that aren't being sent were left by a payout that
+        # failed after the wallet balance changed, or one that crashed. Paying
+        # more before someone has reconciled or reset them risks paying twice.
+        # They're usually cleared from manage.py, so ask the database
+        with self.span('db'):
+            locked = self.storage.locked_count()
+        if locked:
+            if not self.payouts_suspended:
+                self.logger.error(
+                    "{:,} {} payouts are locked, continuous payouts are "
+                    "suspended until they're reconciled or reset".format(
+                        locked, self.config['currency_code']))
+            self.payouts_suspended = True
+            return
+        if self.payouts_suspended:
+            self.logger.info("No {} payouts are locked, resuming continuous "
+                             "payouts".format(self.config['currency_code']))
+            self.payouts_suspended = False
+
+        now = self.utcnow()
+        if self.last_payout_attempt is None:
+            with self.span('db'):
+                self.last_payout_attempt = self.storage.last_paid_time()
+        if (self.last_payout_attempt is not None and
+                (now - self.last_payout_attempt).total_seconds() <
+                self.config['payout_min_spacing']):
+            return
+
+        # Only count what could actually be paid
+        with self.span('db'):
+            balances = self.storage.pending_balances()
+        minimum = to_base_units(repr(self.config['minimum_tx_output']))
+        payable = [amount for amount, count in balances.itervalues()
+                   if amount >= minimum]
+        if not payable:
+            return
+
+        total = float(sum(payable)) / COIN
+        min_total = self.config['payout_min_total']
+        min_addresses = self.config['payout_min_addresses']
+        max_age = self.config['payout_max_age']
+        reason = None
+        if min_total is not None and total >= min_total:
+            reason = "{:,} pending is over {:,}".format(total, min_total)
+        elif min_addresses is not None and len(payable) >= min_addresses:
+            reason = "{:,} addresses pending is over {:,}".format(
+                len(payable), min_addresses)
+        elif max_age is not None:
+            with self.span('db'):
+                oldest = self.storage.oldest_unpaid_time()
+            if oldest is not None and (now - oldest).total_seconds() >= max_age:
+                reason = "oldest unpaid payout was pulled at {}".format(oldest)
+
+        self.logger.debug("{:,} pending for {:,} addresses, payout due: {}"
+                          .format(total, len(payable), reason))
+        return reason
+
+    @crontab
+    def check_pending_balances(self, simulate=False):
+        """ Verifies the pending balance table against the raw payouts and
+        rebuilds it if they disagree (unless simulating) """
+        with self.span('db'):
+            mismatches = self.storage.check_pending_balances()
+
+        if not mismatches:
+            self.logger.info("{} pending balances are consistent"
+                             .format(self.config['currency_code']))
+            return True
+
+        self.logger.error(
+            "{:,} {} pending balances don't match the payouts table\n"
+            .format(len(mismatches), self.config['currency_code']) +
+            tabulate(mismatches, headers=["Address", "Stored", "Actual"], tablefmt="grid"))
+        if simulate:
+            self.logger.info("Just kidding, we're simulating... Exit.")
+            return False
+
+        with self.span('db'):
+            self.storage.rebuild_pending_balances(
+                self.storage.compute_pending_balances())
+            self.storage.commit()
+        self.logger.info("Rebuilt {} pending balances"
+                         .format(self.config['currency_code']))
+        return False
 
     @crontab
     def associate_all(self, simulate=False):
@@ -414,63 +649,66 @@ class SCRPCClient(object):
         if simulate:
             self.logger.info('#'*20 + ' Simulation mode ' + '#'*20)
 
-        payouts = (self.db.session.query(Payout).
-                   filter_by(associated=False,
-                             currency_code=self.config['currency_code']).
-                   filter(Payout.txid != None)
-                   .all())
+        with self.span('db'):
+            payouts = self.storage.paid_unassociated()
 
-        # Build a dict keyed by txid to track payouts.
+        # Build a dict keyed by txid to track payout ids.
         txids = {}
         for payout in payouts:
             txids.setdefault(payout.txid, [])
-            txids[payout.txid].append(payout)
+            txids[payout.txid].append(payout.pid)
+
+        # Skip txids that already have an association waiting in the outbox
+        with self.span('db'):
+            queued = set(txid for txid, in (
+                self.db.session.query(OutboxMessage.txid)
+                .filter_by(action='associate_payouts')))
 
         # Try to grab the fee for each txid
         tx_fees = {}
         for txid in txids.iterkeys():
+            if txid in queued:
+                continue
             try:
-                tx_fees[txid] = self.coin_rpc.get_transaction(txid).fee
+                with self.span('coin_rpc'):
+                    tx_fees[txid] = self.coin_rpc.get_transaction(txid).fee
             except CoinRPCException as e:
                 self.logger.warn('Skipping transaction with id {}, failed '
                                  'looking it up from the {} wallet'
                                  .format(txid, self.config['currency_code']))
                 continue
 
-        for txid, payouts in txids.iteritems():
+        for txid, fee in tx_fees.iteritems():
             if simulate:
                 self.logger.info("Attempting remote association of {:,} ids "
-                                 "with txid {}".format(len(payouts), txid))
-            self.associate(txid, payouts, tx_fees[txid], simulate=simulate)
+                                 "with txid {}".format(len(txids[txid]), txid))
+                continue
+            self._enqueue_association(txid, txids[txid], fee)
 
+        if not simulate:
+            with self.span('db'):
+                self.storage.commit()
+        self.flush_outbox(simulate=simulate)
+
+    @crontab
     def associate(self, txid, payouts, tx_fee, simulate=False):
         """
-        Attempt to associate Payout objects on SC with a specific transaction ID
-        that paid them. Also post the fee incurred by the transaction.
+        Associate Payout objects on SC with a specific transaction ID that
+        paid them, along with the fee incurred by the transaction. Goes
+        through the outbox, so a failed post is retried by flush_outbox.
         """
         pids = [p.pid for p in payouts]
-        self.logger.info("Trying to associate {:,} payouts with txid {}"
+        self.logger.info("Queueing association of {:,} payouts with txid {}"
                          .format(len(payouts), txid))
 
-        data = {'coin_txid': txid, 'pids': pids, 'tx_fee': float(tx_fee),
-                'currency': self.config['currency_code']}
-
         if simulate:
             self.logger.info('We\'re simulating, so don\'t actually post to SC')
             return
 
-        res = self.post('associate_payouts', data=data)
-        if res['result']:
-            self.logger.info("Received success response from the server.")
-            for payout in payouts:
-                payout.associated = True
-                payout.assoc_time = datetime.datetime.utcnow()
-            self.db.session.commit()
-            return True
-        else:
-            self.logger.error("Failed to push association information for {} "
-                              "payouts!".format(self.config['currency_code']))
-        return False
+        with self.span('db'):
+            self._enqueue_association(txid, pids, tx_fee)
+            self.storage.commit()
+        return self.flush_outbox()
 
     @crontab
     def local_associate_locked(self, pid, tx_id, simulate=False):
@@ -478,17 +716,18 @@ class SCRPCClient(object):
         Locally associates a payout, with which is both unpaid and
         locked, with a TXID.
         """
-        payout = (self.db.session.query(Payout)
-                  .filter_by(txid=None, locked=True, id=pid).all())
+        payouts = [p for p in self.storage.unpaid_locked() if p.pid == pid]
+        if not payouts:
+            self.logger.warn("No unpaid, locked payout with pid {}".format(pid))
+            return False
         self.logger.info("Associating payout id {} with TX ID {}"
-                         .format(payout.id, tx_id))
+                         .format(pid, tx_id))
         if simulate:
             self.logger.info("Just kidding, we're simulating... Exit.")
             return
 
-        payout.txid = tx_id
-
-        self.db.session.commit()
+        self.storage.set_txid([pid], tx_id, self.utcnow())
+        self.storage.commit()
         return True
 
     @crontab
@@ -505,22 +744,170 @@ class SCRPCClient(object):
         DB. After you've done this you'll still need to run the functions to
         associate everything on the remote server after.
         """
-        payouts = (self.db.session.query(Payout)
-                   .filter_by(txid=None, locked=True,
-                              currency_code=self.config['currency_code'])
-                   .all())
+        pids = [p.pid for p in self.storage.unpaid_locked()]
         self.logger.info("Associating {:,} payout ids with TX ID {}"
-                         .format(len(payouts), tx_id))
+                         .format(len(pids), tx_id))
         if simulate:
             self.logger.info("Just kidding, we're simulating... Exit.")
             return
 
-        for payout in payouts:
-            payout.txid = tx_id
-
-        self.db.session.commit()
+        self.storage.set_txid(pids, tx_id, self.utcnow())
+        self.storage.commit()
         return True
 
+    def _wallet_sends(self, since):
+        """ Pages back through the wallet's listtransactions history until
+        reaching transactions from before `since`, returning every send output
+        oldest first. Raises CoinRPCException if the wallet can't be listed """
+        account = self.coin_rpc.coinserv['account']
+        page_size = self.config['reconcile_page_size']
+        since_ts = (since - datetime.datetime(1970, 1, 1)).total_seconds()
+        sends = []
+        skip = 0
+        while True:
+            with self.span('coin_rpc'):
+                page = self.coin_rpc.listtransactions(account, page_size, skip)
+            # Conflicted transactions have negative confirmations
+            sends.extend(tx for tx in page if tx.get('category') == 'send' and
+                         tx.get('confirmations', 0) >= 0)
+            if (len(page) < page_size or
+                    min(tx.get('time', 0) for tx in page) < since_ts):
+                break
+            skip += page_size
+        sends.sort(key=lambda tx: tx.get('time', 0))
+        return sends
+
+    def _match_wallet_sends(self, rows, sends):
+        """ Hash joins wallet send outputs against unpaid payouts. A payout
+        transaction pays each address everything that was unpaid for it at the
+        time, so a matching output equals a running total of that address's
+        oldest unpaid payouts. Returns {txid: [pids]} and the sends that
+        matched nothing """
+        by_address = {}
+        for pid, address, amount, lock_time in rows:
+            by_address.setdefault(address, []).append((pid, amount))
+
+        # (address, running total) -> number of payouts making up that total
+        index = {}
+        for address, addr_rows in by_address.iteritems():
+            total = 0
+            for i, (pid, amount) in enumerate(addr_rows):
+                total += to_base_units(amount)
+                index[(address, total)] = i + 1
+
+        # address -> (payouts, amount) already matched to an earlier send
+        matched = {}
+        matches = OrderedDict()
+        unmatched = []
+        for tx in sends:
+            address = tx.get('address')
+            amount = int(round(abs(float(tx['amount'])) * COIN))
+            start, base = matched.get(address, (0, 0))
+            end = index.get((address, base + amount))
+            if end is None or end <= start:
+                unmatched.append(tx)
+                continue
+            matches.setdefault(tx['txid'], []).extend(
+                pid for pid, amount in by_address[address][start:end])
+            matched[address] = (end, base + amount)
+        return matches, unmatched
+
+    @crontab
+    def reconcile(self, simulate=False, since=None):
+        """ Reconciles the wallet's transaction history with locked and unpaid
+        payouts, for use after an RPC error left payouts locked. Wallet sends
+        that aren't recorded locally are matched to payouts by address and
+        amount and their txid recorded. Locked payouts are unlocked when no
+        unrecorded wallet send could have paid them. With simulate the
+        proposed changes are only displayed.
+
+        Only wallet history from reconcile_slack seconds before the oldest
+        lock is read, and nothing at all if no payouts are locked. Pass since
+        (a datetime or unix timestamp) to read back further, e.g. when locked
+        payouts were reset before being reconciled. """
+        with self.span('db'):
+            rows = self.storage.unpaid()
+        locked = [row for row in rows if row[3] is not None]
+        slack = self.config['reconcile_slack']
+        if since is not None:
+            if not isinstance(since, datetime.datetime):
+                since = datetime.datetime.utcfromtimestamp(float(since))
+        elif locked:
+            since = (min(row[3] for row in locked) -
+                     datetime.timedelta(seconds=slack))
+        else:
+            self.logger.info("No locked {} payouts to reconcile"
+                             .format(self.config['currency_code']))
+            return True
+        if not rows:
+            return True
+
+        try:
+            sends = self._wallet_sends(since)
+        except CoinRPCException as e:
+            self.logger.warn(
+                "Error occured while trying to list the {} wallet's "
+                "transactions. Got {}".format(self.config['currency_code'], e))
+            return False
+        with self.span('db'):
+            known = self.storage.known_txids(list(set(tx['txid'] for tx in sends)))
+        sends = [tx for tx in sends if tx['txid'] not in known]
+        matches, unmatched = self._match_wallet_sends(rows, sends)
+        fees = {}
+        for tx in sends:
+            fees.setdefault(tx['txid'], abs(float(tx.get('fee', 0))))
+
+        # Unlocking payouts that were actually paid would pay them twice, so
+        # only unlock a batch if no unexplained send happened after it locked
+        matched_pids = set(pid for pids in matches.itervalues() for pid in pids)
+        unmatched_times = [tx.get('time', 0) for tx in unmatched]
+        latest_unmatched = max(unmatched_times) if unmatched_times else None
+        unlock = []
+        ambiguous = []
+        for pid, address, amount, lock_time in locked:
+            if pid in matched_pids:
+                continue
+            lock_ts = (lock_time - datetime.datetime(1970, 1, 1)).total_seconds()
+            if latest_unmatched is not None and latest_unmatched >= lock_ts - slack:
+                ambiguous.append(pid)
+            else:
+                unlock.append(pid)
+
+        summary = [[txid, len(pids), fees[txid]] for txid, pids in matches.iteritems()]
+        self.logger.info(
+            "Reconciled {:,} {} payouts against {:,} unrecorded wallet sends\n"
+            .format(len(rows), self.config['currency_code'], len(sends)) +
+            tabulate(summary, headers=["Txid", "Pids", "Fee"], tablefmt="grid"))
+        self.logger.info("{:,} locked payouts have no wallet send and can be "
+                         "unlocked".format(len(unlock)))
+        if unmatched:
+            self.logger.warn(
+                "{:,} wallet sends didn't match any payouts\n"
+                .format(len(unmatched)) +
+                tabulate([[tx['txid'], tx.get('address'), tx['amount']]
+                          for tx in unmatched],
+                         headers=["Txid", "Address", "Amount"], tablefmt="grid"))
+        if ambiguous:
+            self.logger.warn("Leaving {:,} payouts locked, they may have been "
+                             "paid by an unmatched wallet send"
+                             .format(len(ambiguous)))
+
+        if simulate:
+            self.logger.info("Just kidding, we're simulating... Exit.")
+            return matches, unlock
+
+        now = self.utcnow()
+        with self.span('db'):
+            for txid, pids in matches.iteritems():
+                self.storage.set_txid(pids, txid, now)
+                self._enqueue_association(txid, pids, fees[txid])
+            if unlock:
+                self.storage.unlock(unlock)
+            self.storage.commit()
+        self.logger.info("Recorded {:,} txids and unlocked {:,} payouts"
+                         .format(len(matches), len(unlock)))
+        return matches, unlock
+
     @crontab
     def confirm_trans(self, simulate=False):
         """ Grabs the unconfirmed transactions objects from the remote server
@@ -529,7 +916,8 @@ class SCRPCClient(object):
         self.logger.info("Attempting to grab unconfirmed {} transactions from "
                          "SC, poking the RPC...".format(self.config['currency_code']))
         try:
-            self.coin_rpc.poke_rpc()
+            with self.span('coin_rpc'):
+                self.coin_rpc.poke_rpc()
         except CoinRPCException as e:
             self.logger.warn(
                 "Error occured while trying to get info from the {} RPC. Got "
@@ -551,7 +939,8 @@ class SCRPCClient(object):
         for sc_obj in res['objects']:
             self.logger.debug("Connecting to coinserv to lookup confirms for {}"
                               .format(sc_obj['txid']))
-            rpc_tx_obj = self.coin_rpc.get_transaction(sc_obj['txid'])
+            with self.span('coin_rpc'):
+                rpc_tx_obj = self.coin_rpc.get_transaction(sc_obj['txid'])
 
             if rpc_tx_obj.confirmations > self.config['min_confirms']:
                 tids.append(sc_obj['txid'])
@@ -567,16 +956,128 @@ class SCRPCClient(object):
             return
 
         if tids:
-            data = {'tids': tids}
-            res = self.post('confirm_transactions', data=data)
-            if res['result']:
-                self.logger.info("Sucessfully confirmed transactions")
-                # XXX: Add number print outs
-                # XXX: Delete/archive payout row
-                return True
-
-            self.logger.error("Failed to push confirmation information")
-            return False
+            for txid in tids:
+                self._enqueue('confirm_transactions', txid, {'tids': [txid]})
+            with self.span('db'):
+                self.storage.commit()
+            return self.flush_outbox()
+
+    ########################################################################
+    # Outbox of pending SC updates
+    ########################################################################
+    def _enqueue(self, action, txid, data):
+        """ Adds a message to the outbox in the current session. The caller
+        is responsible for committing it along with the change it describes.
+        A message already queued for the same action and txid is replaced.
+        Its backoff is only reset if the payload changed """
+        msg = (self.db.session.query(OutboxMessage)
+               .filter_by(action=action, txid=txid).first())
+        if msg is None:
+            msg = OutboxMessage(action=action, txid=txid,
+                                currency_code=self.config['currency_code'],
+                                created_time=self.utcnow())
+            self.db.session.add(msg)
+        payload = json.dumps(data, sort_keys=True)
+        if msg.data != payload:
+            msg.data = payload
+            msg.attempts = 0
+            msg.next_attempt_time = self.utcnow()
+        return msg
+
+    def _enqueue_association(self, txid, pids, tx_fee):
+        data = {'coin_txid': txid, 'pids': list(pids),
+                'tx_fee': float(tx_fee),
+                'currency': self.config['currency_code']}
+        return self._enqueue('associate_payouts', txid, data)
+
+    def _outbox_failed(self, messages, error):
+        """ Backs off messages exponentially after a failed send """
+        now = self.utcnow()
+        for msg in messages:
+            msg.attempts += 1
+            msg.last_error = str(error)
+            delay = min(self.config['outbox_backoff'] * 2 ** (msg.attempts - 1),
+                        self.config['outbox_max_backoff'])
+            msg.next_attempt_time = now + datetime.timedelta(seconds=delay)
+        self.logger.warn("Failed sending {:,} {} outbox messages, backing off: "
+                         "{}".format(len(messages), self.config['currency_code'],
+                                     error))
+
+    @crontab
+    def flush_outbox(self, simulate=False):
+        """ Sends due outbox messages to SC, removing them as SC acknowledges
+        them. Confirmations are combined into a single post per batch. """
+        now = self.utcnow()
+        with self.span('db'):
+            messages = (self.db.session.query(OutboxMessage)
+                        .filter(OutboxMessage.next_attempt_time <= now)
+                        .order_by(OutboxMessage.id)
+                        .limit(self.config['outbox_batch_size'])
+                        .all())
+
+        if not messages:
+            self.logger.debug("No {} outbox messages to send"
+                              .format(self.config['currency_code']))
+            return True
+
+        if simulate:
+            self.logger.info('We\'re simulating, so don\'t actually post to SC')
+            for msg in messages:
+                self.logger.info("Would post {} for txid {}"
+                                 .format(msg.action, msg.txid))
+            return
+
+        sent = 0
+        confirms = []
+        for msg in messages:
+            if msg.action == 'confirm_transactions':
+                confirms.append(msg)
+                continue
+
+            try:
+                res = self.post(msg.action, data=json.loads(msg.data))
+            except (SCRPCException, requests.exceptions.RequestException,
+                    ConnectionError) as e:
+                self._outbox_failed([msg], e)
+            else:
+                if res['result']:
+                    self.logger.info("Associated payouts with txid {} on SC"
+                                     .format(msg.txid))
+                    with self.span('db'):
+                        self.storage.mark_associated(msg.txid,
+                                                     self.utcnow())
+                    self.db.session.delete(msg)
+                    sent += 1
+                else:
+                    self._outbox_failed([msg], "SC returned failure")
+
+            with self.span('db'):
+                self.storage.commit()
+
+        if confirms:
+            tids = [msg.txid for msg in confirms]
+            try:
+                res = self.post('confirm_transactions', data={'tids': tids})
+            except (SCRPCException, requests.exceptions.RequestException,
+                    ConnectionError) as e:
+                self._outbox_failed(confirms, e)
+            else:
+                if res['result']:
+                    self.logger.info("Sucessfully confirmed {:,} transactions"
+                                     .format(len(tids)))
+                    for msg in confirms:
+                        self.db.session.delete(msg)
+                    sent += len(confirms)
+                else:
+                    self._outbox_failed(confirms, "SC returned failure")
+
+            with self.span('db'):
+                self.storage.commit()
+
+        self.logger.info("Sent {:,}/{:,} {} outbox messages"
+                         .format(sent, len(messages),
+                                 self.config['currency_code']))
+        return sent == len(messages)
 
     @crontab
     def get_open_trade_requests(self):
@@ -602,25 +1103,17 @@ class SCRPCClient(object):
                 assert isinstance(currency, basestring)
                 assert isinstance(quantity, float)
                 assert isinstance(type, basestring)
-                assert type == 'buy' or 'sell'
-        except AssertionError:
+                assert type in ('buy', 'sell')
+        except (AssertionError, ValueError):
             self.logger.warn("Invalid TR format returned from RPC call "
                              "get_trade_requests.", exc_info=True)
             return
 
-        brs = []
-        srs = []
-        for tr_id, currency, quantity, type in trs[:]:
-            tr = [tr_id, currency, quantity, type]
-
-            # remove trs not for this currency
-            if currency != self.config['currency_code']:
-                trs.remove(tr)
-
-            if type == 'sell':
-                srs.append(tr)
-            if type == 'buy':
-                brs.append(tr)
+        # Index the trade requests by currency and type in a single pass
+        self.trade_requests = self._index_trade_requests(trs)
+        curr_trs = self.trade_requests.get(self.config['currency_code'], {})
+        srs = curr_trs.get('sell', [])
+        brs = curr_trs.get('buy', [])
 
         self.logger.info("Got {} {} sell requests from SC"
                          .format(len(srs), self.config['currency_code']))
@@ -633,38 +1126,95 @@ class SCRPCClient(object):
         print(tabulate(srs, headers=headers, tablefmt="grid"))
         print("@@ Open {} buy requests @@".format(self.config['currency_code']))
         print(tabulate(brs, headers=headers, tablefmt="grid"))
+        return self.trade_requests
+
+    def _index_trade_requests(self, trs):
+        """ Builds a dictionary of trade requests keyed by currency, then by
+        type. Eg. {'LTC': {'sell': [[tr_id, 'LTC', quantity, 'sell'], ...]}} """
+        index = {}
+        for tr_id, currency, quantity, type in trs:
+            (index.setdefault(currency, {})
+                  .setdefault(type, [])
+                  .append([tr_id, currency, quantity, type]))
+        return index
 
     @crontab
     def close_trade_request(self, tr_id, quantity, total_fees, simulate=False):
+        """ Closes a single trade request. See close_trade_requests """
+        res = self.close_trade_requests([(tr_id, quantity, total_fees)],
+                                        simulate=simulate)
+        if res is None:
+            return
+        return res.get(int(tr_id))
 
+    @crontab
+    def close_trade_requests(self, trs, simulate=False):
+        """
+        Closes many completed trade requests, posting them to SC in batches of
+        `trade_request_batch_size` with one signed update_trade_requests call
+        per batch.
+
+        `trs` is a list of (tr_id, quantity, total_fees) tuples, or a comma
+        separated string of "tr_id:quantity:total_fees" entries when called
+        from the command line.
+        Returns a dictionary of tr_id -> bool indicating whether each trade
+        request was accepted by SC. SC only reports success for a whole
+        update_trade_requests call, so every trade request in a batch gets
+        that batch's result. A batch that fails to post is marked False and
+        the remaining batches are still sent.
+        """
         if simulate:
             self.logger.info('#'*20 + ' Simulation mode ' + '#'*20)
 
-        completed_trs = {tr_id: {'status': 6,
-                                 'quantity': str(quantity),
-                                 'fees': str(total_fees)}}
+        if isinstance(trs, basestring):
+            trs = trs.split(',')
 
-        if not simulate:
+        completed_trs = {}
+        for tr in trs:
+            if isinstance(tr, basestring):
+                tr = tr.split(':')
+            tr_id, quantity, total_fees = tr
+            completed_trs[int(tr_id)] = {'status': 6,
+                                         'quantity': str(quantity),
+                                         'fees': str(total_fees)}
+
+        if simulate:
+            self.logger.info(
+                "Simulating - but would have posted the following dictionary: "
+                "{}".format(pformat(completed_trs)))
+            return
+
+        results = {}
+        tr_ids = sorted(completed_trs.iterkeys())
+        batch_size = self.config['trade_request_batch_size']
+        for i in xrange(0, len(tr_ids), batch_size):
+            batch = {tr_id: completed_trs[tr_id]
+                     for tr_id in tr_ids[i:i + batch_size]}
             # Post the dictionary
-            response = self.post(
-                'update_trade_requests',
-                data={'update': True, 'trs': completed_trs}
-            )
+            try:
+                response = self.post(
+                    'update_trade_requests',
+                    data={'update': True, 'trs': batch}
+                )
+            except (SCRPCException, requests.exceptions.RequestException,
+                    ConnectionError) as e:
+                self.logger.warn("Failed posting a batch of {} trade request "
+                                 "updates to SC: {}".format(len(batch), e))
+                results.update({tr_id: False for tr_id in batch})
+                continue
 
             if 'success' in response:
                 self.logger.info(
                     "Successfully posted {} updated trade requests to SC!"
-                    .format(len(completed_trs)))
+                    .format(len(batch)))
+                results.update({tr_id: True for tr_id in batch})
             else:
                 self.logger.warn(
                     "Failed posting request updates! Attempted to post the "
-                    "following dictionary: {}".format(pformat(completed_trs)))
-        else:
-            self.logger.info(
-                "Simulating - but would have posted the following dictionary: "
-                "{}".format(pformat(completed_trs)))
-
+                    "following dictionary: {}".format(pformat(batch)))
+                results.update({tr_id: False for tr_id in batch})
 
+        return results
 
     ########################################################################
     # Helpful local data management + analysis methods
@@ -672,21 +1222,23 @@ class SCRPCClient(object):
     @crontab
     def reset_all_locked(self, simulate=False):
         """ Resets all locked payouts """
-        payouts = self.db.session.query(Payout).filter_by(locked=True)
-        self.logger.info("Resetting {:,} payout ids".format(payouts.count()))
         if simulate:
+            self.logger.info("Resetting {:,} payout ids"
+                             .format(len(self.storage.unpaid_locked())))
             self.logger.info("Just kidding, we're simulating... Exit.")
             return
 
-        payouts.update({Payout.locked: False})
-        self.db.session.commit()
+        count = self.storage.unlock()
+        self.storage.commit()
+        self.logger.info("Reset {:,} payout ids".format(count))
 
     @crontab
     def init_db(self, simulate=False):
         """ Deletes all data from DB and rebuilds tables. Use carefully... """
-        Payout.__table__.drop(self.engine, checkfirst=True)
-        Payout.__table__.create(self.engine, checkfirst=True)
-        self.db.session.commit()
+        self.storage.reset(self.engine)
+        OutboxMessage.__table__.drop(self.engine, checkfirst=True)
+        OutboxMessage.__table__.create(self.engine, checkfirst=True)
+        self.storage.commit()
 
     def _tabulate(self, title, query, headers=None, data=None):
         """ Displays a table of payouts given a query to fetch payouts with, a
@@ -701,7 +1253,8 @@ class SCRPCClient(object):
             print("-- Nothing to display --")
         print("")
 
-    def dump_incomplete(self, unpaid_locked=True, paid_unassoc=True, unpaid_unlocked=True):
+    def dump_incomplete(self, unpaid_locked=True, paid_unassoc=True,
+                        unpaid_unlocked=True, outbox=True):
         """ Prints out a nice display of all incomplete payout records. """
         if unpaid_locked:
             self.unpaid_locked()
@@ -709,27 +1262,35 @@ class SCRPCClient(object):
             self.paid_unassoc()
         if unpaid_unlocked:
             self.unpaid_unlocked()
+        if outbox:
+            self.pending_outbox()
+
+    def pending_outbox(self):
+        self._tabulate(
+            "Pending {} SC updates".format(self.config['currency_code']),
+            self.db.session.query(OutboxMessage).order_by(OutboxMessage.id).all(),
+            headers=["action", "txid", "attempts", "next_attempt_time", "last_error"])
 
     def unpaid_locked(self):
         self._tabulate(
             "Unpaid locked {} payouts".format(self.config['currency_code']),
-            self.db.session.query(Payout).filter_by(txid=None, locked=True).all())
+            self.storage.unpaid_locked())
 
     def paid_unassoc(self):
         self._tabulate(
             "Paid un-associated {} payouts".format(self.config['currency_code']),
-            self.db.session.query(Payout).filter_by(associated=False).filter(Payout.txid != None).all())
+            self.storage.paid_unassociated())
 
     def unpaid_unlocked(self):
         self._tabulate(
             "{} payouts ready to payout".format(self.config['currency_code']),
-            self.db.session.query(Payout).filter_by(txid=None, locked=False).all())
+            self.storage.unpaid_unlocked())
 
     def dump_complete(self):
         """ Prints out a nice display of all completed payout records. """
         self._tabulate(
             "Paid + associated {} payouts".format(self.config['currency_code']),
-            self.db.session.query(Payout).filter_by(associated=True).filter(Payout.txid != None).all())
+            self.storage.paid_associated())
 
     def call(self, command, **kwargs):
         try:
@@ -745,6 +1306,8 @@ def entry():
     parser.add_argument('-l', '--log-level',
                         choices=['DEBUG', 'INFO', 'WARN', 'ERROR'])
     parser.add_argument('-s', '--simulate', action='store_true', default=False)
+    parser.add_argument('-p', '--profile', action='store_true', default=False,
+                        help='record timing spans and cProfile output per run')
     subparsers = parser.add_subparsers(title='main subcommands', dest='action')
 
     subparsers.add_parser('confirm_trans',
@@ -754,10 +1317,16 @@ def entry():
     subparsers.add_parser('reset_all_locked', help='resets all locked payouts')
     subparsers.add_parser('dump_incomplete', help='')
     subparsers.add_parser('associate_all', help='')
+    subparsers.add_parser('flush_outbox', help='sends pending SC updates from the outbox')
+    subparsers.add_parser('preview_payout', help='shows what would be paid out right now')
+    subparsers.add_parser('reconcile', help='matches locked payouts to wallet transactions')
+    subparsers.add_parser('payout_due', help='checks the continuous payout thresholds')
+    subparsers.add_parser('check_pending_balances',
+                          help='verifies (and repairs) the pending balance table')
 
     args = parser.parse_args()
 
-    global_args = ['log_level', 'action', 'config']
+    global_args = ['log_level', 'action', 'config', 'profile']
     # subcommand functions shouldn't recieve arguments directed at the
     # global object/ configs
     kwargs = {k: v for k, v in vars(args).iteritems() if k not in global_args}
@@ -765,5 +1334,7 @@ def entry():
     config = yaml.load(args.config)
     if args.log_level:
         config['log_level'] = args.log_level
+    if args.profile:
+        config['profile'] = True
     interface = SCRPCClient(config)
     interface.call(args.action, **kwargs)
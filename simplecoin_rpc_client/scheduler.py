@@ -1,50 +1,226 @@
+import datetime
+import functools
 import logging
 import os
+import threading
+import time
 import sqlalchemy
 import setproctitle
 import argparse
 import yaml
 
+from collections import OrderedDict
 from apscheduler.scheduler import Scheduler
-from cryptokit.rpc_wrapper import CoinRPC
-from simplecoin_rpc_client.sc_rpc import SCRPCClient
+from apscheduler.triggers import CronTrigger, IntervalTrigger
+from urllib3.exceptions import ConnectionError
+from simplecoin_rpc_client.coin_rpc import CoinRPC
+from simplecoin_rpc_client.sc_rpc import SCRPCClient, SCRPCException
+from simplecoin_rpc_client.status import serve_status
 
 logger = logging.getLogger('apscheduler.scheduler')
 os_root = os.path.abspath(os.path.dirname(__file__) + '/../')
 
 
 class PayoutManager(object):
+    """ Runs the payout jobs for each currency. Jobs for a single currency
+    never overlap: the frequent jobs (pulls, outbox flushes) are skipped if the
+    currency is busy, while the nightly jobs wait their turn. Pulls are run
+    from a short tick and adapt their interval to how long they take and how
+    many payouts SC hands back. Currencies with combined_pull set that share
+    an SC server are pulled with a single request. """
 
-    def __init__(self, logger, sc_rpc, coin_rpc):
+    # Don't let pulls spend more than 1/pull_duty_cycle of the time running
+    pull_duty_cycle = 4
+
+    def __init__(self, logger, sc_rpc, coin_rpc, clock=time.time):
         self.logger = logger
         self.sc_rpc = sc_rpc
         self.coin_rpc = coin_rpc
+        self.clock = clock
 
-    def pull_payouts(self):
+        self.locks = {}
+        self.pull_interval = {}
+        self.next_pull = {}
+        # currency -> job name -> details of its last run, for status()
+        self.last_run = {}
+        # SC server -> when to next try a combined pull, for servers that
+        # didn't support one
+        self.combined_retry = {}
         for currency, sc_rpc in self.sc_rpc.iteritems():
-            sc_rpc.pull_payouts()
+            self.locks[currency] = threading.Lock()
+            self.pull_interval[currency] = sc_rpc.config['pull_interval']
+            self.next_pull[currency] = 0
+            self.last_run[currency] = {}
 
-    def send_payout(self):
-        for currency, sc_rpc in self.sc_rpc.iteritems():
+    def _currencies(self, currency=None):
+        if currency is None:
+            return self.sc_rpc.items()
+        return [(currency, self.sc_rpc[currency])]
 
-            # Try to pay out known payouts
-            result = sc_rpc.send_payout()
-            if isinstance(result, bool):
+    def _run(self, currency, func, blocking=True, name=None):
+        """ Runs func while holding the currency's lock. When not blocking and
+        another job holds the lock, skips the run and returns None. The run
+        is recorded in last_run under name, by default func's name """
+        lock = self.locks[currency]
+        # Unwrap functools.partial for its name
+        name = name or getattr(func, 'func', func).__name__
+        if not lock.acquire(blocking):
+            self.logger.info("Skipping {} for {}, another job is still running"
+                             .format(name, currency))
+            return
+        start = self.clock()
+        t = time.time()
+        failed = True
+        try:
+            result = func()
+            # crontab logs and swallows the exceptions of a job, leaving the
+            # last one on the client
+            failed = (result is False or
+                      self.sc_rpc[currency].last_error is not None)
+            return result
+        finally:
+            self.last_run[currency][name] = dict(
+                time=start, duration=round(time.time() - t, 6), failed=failed)
+            lock.release()
+
+    def _adapt_pull_interval(self, currency, count, duration):
+        """ Pull more often while SC has payouts for us, back off while it
+        doesn't or when pulls fail. Never pull more often than pulls allow """
+        config = self.sc_rpc[currency].config
+        interval = self.pull_interval[currency]
+        if count:
+            interval /= 2.0
+        else:
+            interval *= 1.5
+        interval = max(interval, config['min_pull_interval'],
+                       duration * self.pull_duty_cycle)
+        interval = min(interval, config['max_pull_interval'])
+        self.pull_interval[currency] = interval
+        self.next_pull[currency] = self.clock() + interval
+        self.logger.debug("Next {} pull in {:,.1f}s".format(currency, interval))
+
+    def pull_payouts(self, currency=None):
+        """ Pulls payouts for every currency that is due a pull """
+        groups = OrderedDict()
+        for currency, sc_rpc in sorted(self._currencies(currency)):
+            if self.clock() < self.next_pull[currency]:
                 continue
+            if sc_rpc.config['combined_pull']:
+                key = (sc_rpc.config['rpc_url'], sc_rpc.config['rpc_signature'])
             else:
-                coin_txid, tx, payouts = result
-                sc_rpc.associate_all()
+                key = currency
+            groups.setdefault(key, []).append(currency)
 
-            # Push completed payouts to SC
-            sc_rpc.associate(coin_txid, payouts, tx.fee)
+        for key, currencies in groups.iteritems():
+            if (len(currencies) > 1 and
+                    self.clock() >= self.combined_retry.get(key, 0) and
+                    self._pull_combined(key, currencies)):
+                continue
+            for currency in currencies:
+                start = time.time()
+                count = self._run(currency, self.sc_rpc[currency].pull_payouts,
+                                  blocking=False)
+                self._adapt_pull_interval(currency, count, time.time() - start)
 
-    def associate_all_payouts(self):
-        for currency, sc_rpc in self.sc_rpc.iteritems():
-            sc_rpc.associate_all()
+    def _pull_combined(self, key, currencies):
+        """ Pulls payouts for currencies sharing an SC server in one request,
+        then stores each currency's payouts in parallel. Returns False if the
+        server doesn't support combined pulls """
+        sc_rpc = self.sc_rpc[currencies[0]]
+        started = self.clock()
+        start = time.time()
+        try:
+            payouts = sc_rpc.get_combined_payouts(currencies)
+        except SCRPCException as e:
+            retry = sc_rpc.config['combined_pull_retry']
+            self.logger.warn("Combined pull of {} failed ({}), pulling each "
+                             "currency separately for the next {:,}s"
+                             .format(", ".join(currencies), e, retry))
+            self.combined_retry[key] = self.clock() + retry
+            return False
+        except ConnectionError:
+            self.logger.warn('Unable to connect to SC!', exc_info=True)
+            failed = True
+        except Exception:
+            # Timeouts, malformed bodies and the like. Handled as a failed
+            # per currency pull would be, by backing off every currency
+            self.logger.error("Unhandled exception in combined pull of {}"
+                              .format(", ".join(currencies)), exc_info=True)
+            failed = True
+        else:
+            failed = False
+        if failed:
+            for currency in currencies:
+                self._adapt_pull_interval(currency, None, time.time() - start)
+                self.last_run[currency]['pull_payouts'] = dict(
+                    time=started, duration=round(time.time() - start, 6),
+                    failed=True)
+            return True
 
-    def confirm_payouts(self):
-        for currency, sc_rpc in self.sc_rpc.iteritems():
-            sc_rpc.confirm_trans()
+        # Each currency has its own database, so the writes can overlap
+        counts = {}
+
+        def store(currency):
+            counts[currency] = self._run(
+                currency, functools.partial(self.sc_rpc[currency].store_payouts,
+                                            payouts[currency]),
+                blocking=False, name='pull_payouts')
+        threads = [threading.Thread(target=store, args=(currency, ))
+                   for currency in currencies]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        duration = time.time() - start
+        for currency in currencies:
+            self._adapt_pull_interval(currency, counts.get(currency), duration)
+        return True
+
+    def send_payout(self, currency=None):
+        for currency, sc_rpc in self._currencies(currency):
+
+            # Try to pay out known payouts
+            result = self._run(currency, sc_rpc.send_payout)
+            if isinstance(result, bool) or result is None:
+                continue
+
+            # Push the association queued by send_payout to SC
+            self._run(currency, sc_rpc.flush_outbox)
+
+    def check_payouts(self, currency=None):
+        """ Sends a payout for any continuous mode currency whose payout
+        thresholds have been met """
+        for currency, sc_rpc in self._currencies(currency):
+            if sc_rpc.config['payout_mode'] != 'continuous':
+                continue
+            reason = self._run(currency, sc_rpc.payout_due, blocking=False)
+            if reason:
+                self.logger.info("Sending {} payout early, {}"
+                                 .format(currency, reason))
+                self.send_payout(currency)
+
+    def associate_all_payouts(self, currency=None):
+        for currency, sc_rpc in self._currencies(currency):
+            self._run(currency, sc_rpc.associate_all)
+
+    def flush_outbox(self, currency=None):
+        for currency, sc_rpc in self._currencies(currency):
+            self._run(currency, sc_rpc.flush_outbox, blocking=False)
+
+    def confirm_payouts(self, currency=None):
+        for currency, sc_rpc in self._currencies(currency):
+            self._run(currency, sc_rpc.confirm_trans)
+
+    def status(self):
+        """ Payout counts and totals by state, and the last run of each job,
+        per currency. Cheap enough to poll """
+        res = {}
+        for currency, sc_rpc in self.sc_rpc.items():
+            res[currency] = dict(payouts=sc_rpc.storage.status(),
+                                 jobs=dict(self.last_run[currency]),
+                                 pull_interval=self.pull_interval[currency])
+        return res
 
     def init_db(self):
         for currency, sc_rpc in self.sc_rpc.iteritems():
@@ -59,6 +235,37 @@ class PayoutManager(object):
             sc_rpc.dump_complete()
 
 
+def job_triggers(pm, cfg, start_date=None):
+    """ The scheduled PayoutManager jobs as (name, function, trigger) tuples.
+    Shared by the real scheduler and the replay harness. The nightly jobs are
+    scheduled per currency from each currency's *_cron settings """
+    flush_interval = cfg['sc_rpc_client'].get('outbox_flush_interval', 10)
+    pull_tick = min(sc_rpc.config['min_pull_interval']
+                    for sc_rpc in pm.sc_rpc.itervalues())
+    jobs = [
+        ('pull_payouts', pm.pull_payouts,
+         IntervalTrigger(datetime.timedelta(seconds=pull_tick), start_date)),
+        ('flush_outbox', pm.flush_outbox,
+         IntervalTrigger(datetime.timedelta(seconds=flush_interval), start_date)),
+    ]
+    continuous = [sc_rpc.config['payout_check_interval']
+                  for sc_rpc in pm.sc_rpc.itervalues()
+                  if sc_rpc.config['payout_mode'] == 'continuous']
+    if continuous:
+        jobs.append(('check_payouts', pm.check_payouts,
+                     IntervalTrigger(datetime.timedelta(seconds=min(continuous)),
+                                     start_date)))
+    for currency, sc_rpc in sorted(pm.sc_rpc.iteritems()):
+        for name, func, cron in [
+                ('send_payout', pm.send_payout, 'payout_cron'),
+                ('associate_all_payouts', pm.associate_all_payouts, 'associate_cron'),
+                ('confirm_payouts', pm.confirm_payouts, 'confirm_cron')]:
+            jobs.append(("{}_{}".format(name, currency),
+                         functools.partial(func, currency),
+                         CronTrigger(**sc_rpc.config[cron])))
+    return jobs
+
+
 def entry():
     parser = argparse.ArgumentParser(prog='simplecoin rpc client scheduler')
     parser.add_argument('-l', '--log-level',
@@ -66,6 +273,8 @@ def entry():
                         default='INFO')
     parser.add_argument('-cl', '--config-location',
                         default='/config.yml')
+    parser.add_argument('-p', '--profile', action='store_true', default=False,
+                        help='record timing spans and cProfile output per job run')
     args = parser.parse_args()
 
     # Setup logging
@@ -92,22 +301,28 @@ def entry():
         coin_rpc[cc] = CoinRPC(curr_cfg, logger=logger)
 
         curr_cfg.update(cfg['sc_rpc_client'])
+        if args.profile:
+            curr_cfg['profile'] = True
         sc_rpc[cc] = SCRPCClient(curr_cfg, coin_rpc[cc], logger=logger)
 
     pm = PayoutManager(logger, sc_rpc, coin_rpc)
 
-    sched = Scheduler(standalone=True)
+    status_port = cfg['sc_rpc_client'].get('status_port')
+    if status_port:
+        serve_status(pm, cfg['sc_rpc_client'].get('status_host', '127.0.0.1'),
+                     status_port)
+
+    # Never run two instances of a job at once, and collapse runs missed while
+    # the scheduler was busy into one
+    sched = Scheduler(standalone=True, coalesce=True, misfire_grace_time=3600)
     logger.info("=" * 80)
     logger.info("SimpleCoin cron scheduler starting up...")
     setproctitle.setproctitle("simplecoin_scheduler")
 
     # All these tasks actually change the database, and shouldn't
     # be run by the staging server
-    sched.add_cron_job(pm.pull_payouts, minute='*/1')
-    sched.add_cron_job(pm.send_payout, hour='23')
-    sched.add_cron_job(pm.associate_all_payouts, hour='0')
-    sched.add_cron_job(pm.confirm_payouts, hour='1')
-
+    for name, func, trigger in job_triggers(pm, cfg):
+        sched.add_job(trigger, func, None, None, name=name, max_instances=1)
 
     sched.start()
 
@@ -0,0 +1,48 @@
+"""
+A small read only HTTP endpoint reporting the state of the payout pipeline
+from inside the scheduler process.
+
+    GET /status
+
+Returns JSON with, for each currency, the count and total amount of payouts
+in each state and when each job last ran. Payout totals come from counters
+the storage engines keep up to date as payouts change state, so polling this
+never queries the database.
+"""
+import BaseHTTPServer
+import json
+import logging
+import threading
+
+
+logger = logging.getLogger('apscheduler.scheduler')
+
+
+class StatusHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0] not in ('/', '/status'):
+            self.send_error(404)
+            return
+        body = json.dumps(self.server.payout_manager.status(),
+                          sort_keys=True, indent=2)
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug("Status request from {}: {}"
+                     .format(self.client_address[0], format % args))
+
+
+def serve_status(payout_manager, host='127.0.0.1', port=8010):
+    """ Starts serving the status endpoint on a daemon thread and returns the
+    server """
+    server = BaseHTTPServer.HTTPServer((host, port), StatusHandler)
+    server.payout_manager = payout_manager
+    thread = threading.Thread(target=server.serve_forever, name='status_server')
+    thread.daemon = True
+    thread.start()
+    logger.info("Serving status on http://{}:{}/status".format(host, port))
+    return server
@@ -0,0 +1,719 @@
+"""
+Storage engines for local payout state.
+
+SCRPCClient only talks to payouts through the small interface defined by
+Storage, so the cost of persistence can be measured and tuned separately from
+the RPC logic. Two engines are provided:
+
+    sqlite - the default. Bulk executemany statements built once and reused,
+             configurable pragmas and covering indexes for the state queries.
+    memory - keeps everything in Python dictionaries. Useful for tests and
+             benchmarks, nothing survives the process.
+
+Both share the SCRPCClient session's transaction (which also carries the
+outbox), so commit and rollback cover payouts and outbox messages together.
+Both also maintain a per-address pending balance aggregate of the unpaid,
+unlocked payouts in the same transaction as the change to the payouts, and
+in memory counts and totals of the payouts in each state for status reporting.
+"""
+import abc
+import sqlalchemy as sa
+
+from collections import namedtuple, OrderedDict
+from decimal import Decimal
+from simplecoin_rpc_client.models import Payout, PendingBalance
+
+
+# Base units per coin
+COIN = 10 ** 8
+
+
+columns = ['id', 'pid', 'user', 'address', 'amount', 'currency_code', 'txid',
+           'associated', 'locked', 'lock_time', 'paid_time', 'assoc_time',
+           'pull_time']
+
+
+class PayoutRow(namedtuple('PayoutRow', columns)):
+    """ An immutable snapshot of a payout as returned by the storage engines.
+    Mirrors the display helpers on the Payout model """
+    __slots__ = ()
+
+    @property
+    def trans_id(self):
+        if self.txid is None:
+            return "NULL"
+        return self.txid
+
+    @property
+    def amount_float(self):
+        return float(self.amount)
+
+    def tabulize(self, columns):
+        return [getattr(self, a) for a in columns]
+
+
+def to_base_units(amount):
+    """ Converts an amount string (as stored) to integer base units """
+    # Plain "123.45678" strings are by far the most common, and splitting them
+    # is much cheaper than going through Decimal
+    if isinstance(amount, basestring) and 'e' not in amount and 'E' not in amount:
+        whole, _, frac = amount.partition('.')
+        if len(frac) <= 8 and not whole.startswith('-'):
+            return int(whole or 0) * COIN + int(frac.ljust(8, '0'))
+    return int((Decimal(str(amount)) * COIN).to_integral_value())
+
+
+def pending_deltas(rows, sign):
+    """ Builds {address: [amount, count]} changes to the pending balances for
+    rows entering (sign 1) or leaving (sign -1) the unpaid, unlocked state """
+    deltas = {}
+    for address, amount in rows:
+        delta = deltas.setdefault(address, [0, 0])
+        delta[0] += sign * to_base_units(amount)
+        delta[1] += sign
+    return deltas
+
+
+def state_of(row):
+    """ Which of the status counter states a payout is in """
+    if row.txid is None:
+        return 'locked' if row.locked else 'ready'
+    return 'associated' if row.associated else 'paid_unassoc'
+
+
+def chunks(lst, size=500):
+    """ SQLite limits the number of bound parameters in a statement """
+    for i in xrange(0, len(lst), size):
+        yield lst[i:i + size]
+
+
+class Storage(object):
+    """ The operations SCRPCClient performs on its payouts. All methods act on
+    the configured currency only, and nothing is durable until commit() """
+    __metaclass__ = abc.ABCMeta
+    states = ('ready', 'locked', 'paid_unassoc', 'associated')
+
+    def __init__(self, db, currency_code):
+        self.db = db
+        self.currency_code = currency_code
+        # state -> (count, amount in base units). Replaced wholesale on commit
+        # so readers in other threads always see a consistent snapshot
+        self.counters = dict.fromkeys(self.states, (0, 0))
+        self._counter_deltas = {}
+
+    @abc.abstractmethod
+    def setup(self, engine):
+        """ Create any tables or indexes needed """
+
+    @abc.abstractmethod
+    def reset(self, engine):
+        """ Deletes all payouts """
+
+    def commit(self):
+        self.db.session.commit()
+        if self._counter_deltas:
+            counters = dict(self.counters)
+            for state, (count, amount) in self._counter_deltas.iteritems():
+                counters[state] = (counters[state][0] + count,
+                                   counters[state][1] + amount)
+            self.counters = counters
+            self._counter_deltas = {}
+
+    def rollback(self):
+        self.db.session.rollback()
+        self._counter_deltas = {}
+
+    def _move(self, amounts, from_state, to_state):
+        """ Stages moving payouts with the given amounts between states in the
+        status counters. Applied on commit """
+        count = 0
+        total = 0
+        for amount in amounts:
+            count += 1
+            total += to_base_units(amount)
+        if not count:
+            return
+        for state, sign in ((from_state, -1), (to_state, 1)):
+            if state is None:
+                continue
+            delta = self._counter_deltas.get(state, (0, 0))
+            self._counter_deltas[state] = (delta[0] + sign * count,
+                                           delta[1] + sign * total)
+
+    @abc.abstractmethod
+    def compute_counters(self):
+        """ Counts and totals the payouts in each state from scratch """
+
+    def load_counters(self):
+        self.counters = self.compute_counters()
+        self._counter_deltas = {}
+
+    def status(self):
+        """ Count and total amount of the payouts in each state, as of the
+        last commit """
+        return {state: {'count': count, 'amount': float(amount) / COIN}
+                for state, (count, amount) in self.counters.iteritems()}
+
+    @abc.abstractmethod
+    def insert_payouts(self, payouts):
+        """ Inserts new payouts given as dictionaries of column values, skipping
+        any whose pid already exists. Returns the number inserted """
+
+    @abc.abstractmethod
+    def unpaid_by_address(self):
+        """ Unpaid, unlocked payouts as a dictionary of address -> [PayoutRow] """
+
+    @abc.abstractmethod
+    def unpaid_columns(self):
+        """ Unpaid, unlocked payouts as parallel sequences of pids, addresses
+        and amounts, in no particular order """
+
+    @abc.abstractmethod
+    def lock(self, pids, lock_time):
+        """ Locks the given pids so no other payout will pay them """
+
+    @abc.abstractmethod
+    def unlock(self, pids=None):
+        """ Unlocks the given pids, or every locked payout if pids is None.
+        Returns the number unlocked """
+
+    @abc.abstractmethod
+    def set_txid(self, pids, txid, paid_time):
+        """ Records that the given payouts were paid by txid and unlocks them """
+
+    @abc.abstractmethod
+    def mark_associated(self, txid, assoc_time):
+        """ Marks all payouts paid by txid as associated on SC. Returns the
+        number marked """
+
+    @abc.abstractmethod
+    def unpaid_locked(self):
+        """ Unpaid, locked payouts as PayoutRows """
+
+    @abc.abstractmethod
+    def paid_unassociated(self):
+        """ Paid payouts SC hasn't been told about, as PayoutRows """
+
+    @abc.abstractmethod
+    def unpaid_unlocked(self):
+        """ Unpaid, unlocked payouts as PayoutRows """
+
+    @abc.abstractmethod
+    def paid_associated(self):
+        """ Paid payouts associated on SC, as PayoutRows """
+
+    @abc.abstractmethod
+    def known_txids(self, txids):
+        """ The subset of txids that already paid a payout """
+
+    @abc.abstractmethod
+    def unpaid(self):
+        """ (pid, address, amount, lock_time) of every unpaid payout, oldest
+        first. lock_time is None for unlocked payouts """
+
+    def incomplete(self):
+        """ All payouts that aren't both paid and associated, by state """
+        return {'unpaid_locked': self.unpaid_locked(),
+                'paid_unassoc': self.paid_unassociated(),
+                'unpaid_unlocked': self.unpaid_unlocked()}
+
+    @abc.abstractmethod
+    def oldest_unpaid_time(self, locked=False):
+        """ pull_time of the oldest unpaid, unlocked payout, or None. Includes
+        locked payouts if locked is True """
+
+    @abc.abstractmethod
+    def last_paid_time(self):
+        """ paid_time of the most recently paid payout, or None """
+
+    @abc.abstractmethod
+    def locked_count(self):
+        """ Number of unpaid, locked payouts, read from the store rather than
+        the counters so changes made by other processes are seen """
+
+    @abc.abstractmethod
+    def pending_balances(self):
+        """ The maintained aggregate of unpaid, unlocked payouts as a
+        dictionary of address -> (amount in base units, number of payouts) """
+
+    @abc.abstractmethod
+    def rebuild_pending_balances(self, balances):
+        """ Replaces the pending balance aggregate with the one given """
+
+    def compute_pending_balances(self):
+        """ Rebuilds the pending balances from the raw payouts """
+        deltas = pending_deltas(
+            ((p.address, p.amount) for p in self.unpaid_unlocked()), 1)
+        return {address: tuple(delta) for address, delta in deltas.iteritems()}
+
+    def check_pending_balances(self):
+        """ Compares the maintained aggregate against one rebuilt from the raw
+        payouts. Returns a list of (address, stored, actual) mismatches """
+        stored = self.pending_balances()
+        actual = self.compute_pending_balances()
+        mismatches = []
+        for address in set(stored) | set(actual):
+            if stored.get(address) != actual.get(address):
+                mismatches.append((address, stored.get(address),
+                                   actual.get(address)))
+        return sorted(mismatches)
+
+
+class SQLiteStorage(Storage):
+    table = Payout.__table__
+    pending_table = PendingBalance.__table__
+
+    def __init__(self, db, currency_code):
+        super(SQLiteStorage, self).__init__(db, currency_code)
+        t = self.table
+        # Build all statements once so pysqlite's statement cache can reuse
+        # the prepared statements across calls and executemany batches
+        self._insert = t.insert().prefix_with('OR IGNORE')
+        self._lock = (t.update()
+                      .where(t.c.pid == sa.bindparam('b_pid'))
+                      .values(locked=True,
+                              lock_time=sa.bindparam('b_time', type_=sa.DateTime)))
+        self._unlock = (t.update()
+                        .where(t.c.pid == sa.bindparam('b_pid'))
+                        .values(locked=False, lock_time=None))
+        self._set_txid = (t.update()
+                          .where(t.c.pid == sa.bindparam('b_pid'))
+                          .values(locked=False,
+                                  txid=sa.bindparam('b_txid'),
+                                  paid_time=sa.bindparam('b_time', type_=sa.DateTime)))
+        self._select = sa.select([t.c[c] for c in columns])
+
+        pb = self.pending_table
+        self._pending_insert = pb.insert().prefix_with('OR IGNORE')
+        self._pending_update = (pb.update()
+                                .where(pb.c.currency_code == self.currency_code)
+                                .where(pb.c.address == sa.bindparam('b_address'))
+                                .values(amount=pb.c.amount + sa.bindparam('b_amount'),
+                                        count=pb.c.count + sa.bindparam('b_count')))
+        self._pending_delete = (pb.delete()
+                                .where(pb.c.currency_code == self.currency_code)
+                                .where(pb.c.address == sa.bindparam('b_address'))
+                                .where(pb.c.count <= 0))
+
+    def setup(self, engine):
+        self.table.create(engine, checkfirst=True)
+        new_pending = not engine.has_table(self.pending_table.name)
+        self.pending_table.create(engine, checkfirst=True)
+        # Databases from before the aggregate existed need it populated
+        if new_pending:
+            self.rebuild_pending_balances(self.compute_pending_balances())
+            self.commit()
+        # Covering the state queries. Issued as raw DDL so they're added to
+        # databases created before the indexes existed. associated, amount
+        # and pid make it cover compute_counters and unpaid_columns too,
+        # replacing the narrower indexes used before
+        engine.execute("DROP INDEX IF EXISTS ix_payouts_unpaid")
+        engine.execute("DROP INDEX IF EXISTS ix_payouts_unpaid_cover")
+        engine.execute("CREATE INDEX IF NOT EXISTS ix_payouts_state_cover "
+                       "ON payouts (currency_code, txid, locked, associated, "
+                       "address, amount, pid)")
+        engine.execute("CREATE INDEX IF NOT EXISTS ix_payouts_txid "
+                       "ON payouts (txid, associated)")
+        self.load_counters()
+
+    def reset(self, engine):
+        self.table.drop(engine, checkfirst=True)
+        self.pending_table.drop(engine, checkfirst=True)
+        self.setup(engine)
+
+    def _execute(self, stmt, params=None):
+        if params is None:
+            return self.db.session.execute(stmt)
+        return self.db.session.execute(stmt, params)
+
+    def _rows(self, *where):
+        t = self.table
+        stmt = self._select.where(t.c.currency_code == self.currency_code)
+        for clause in where:
+            stmt = stmt.where(clause)
+        return [PayoutRow(*row) for row in self._execute(stmt.order_by(t.c.id))]
+
+    def _select_in(self, sql, pids):
+        """ Runs sql, which ends in "IN ", for every chunk of pids on the
+        session's DBAPI connection. Compiling large IN clauses through
+        SQLAlchemy costs far more than running them, and reusing the same SQL
+        string for every full chunk lets pysqlite reuse its prepared
+        statement """
+        conn = self.db.session.connection().connection
+        res = []
+        for chunk in chunks(pids):
+            res.extend(conn.execute(
+                sql + "({})".format(",".join("?" * len(chunk))), chunk))
+        return res
+
+    def _select_state(self, pids, where):
+        """ (address, amount) of the given pids that also match where """
+        return self._select_in(
+            "SELECT address, amount FROM payouts WHERE {} AND pid IN "
+            .format(where), pids)
+
+    def compute_counters(self):
+        t = self.table
+        # Amounts are stored as strings, so convert each to integer base
+        # units in SQL. round() gives a REAL, and summing those would lose
+        # precision past 2 ** 53 base units
+        amount = sa.cast(sa.func.round(sa.cast(t.c.amount, sa.Float) * COIN),
+                         sa.Integer)
+        # One query per state, each a range of ix_payouts_state_cover, so the
+        # totals come from the index without touching the table
+        counts = sa.select([sa.func.count(), sa.func.sum(amount)]).where(
+            t.c.currency_code == self.currency_code)
+        counters = {}
+        for state, where in (('ready', (t.c.txid == None, t.c.locked == False)),
+                             ('locked', (t.c.txid == None, t.c.locked == True)),
+                             ('paid_unassoc', (t.c.txid != None,
+                                               t.c.associated == False)),
+                             ('associated', (t.c.txid != None,
+                                             t.c.associated == True))):
+            count, total = self._execute(counts.where(sa.and_(*where))).first()
+            counters[state] = (count, int(total or 0))
+        self.db.session.commit()
+        return counters
+
+    def _apply_pending(self, deltas):
+        if not deltas:
+            return
+        params = [{'b_address': address, 'b_amount': amount, 'b_count': count}
+                  for address, (amount, count) in deltas.iteritems()]
+        self._execute(self._pending_insert,
+                      [{'currency_code': self.currency_code, 'address': address,
+                        'amount': 0, 'count': 0} for address in deltas])
+        self._execute(self._pending_update, params)
+        self._execute(self._pending_delete, params)
+
+    def insert_payouts(self, payouts):
+        if not payouts:
+            return 0
+        existing = set(pid for pid, in self._select_in(
+            "SELECT pid FROM payouts WHERE pid IN ",
+            [p['pid'] for p in payouts]))
+
+        new = []
+        for p in payouts:
+            if p['pid'] in existing:
+                continue
+            existing.add(p['pid'])
+            p.setdefault('associated', False)
+            p.setdefault('locked', False)
+            new.append(p)
+
+        if new:
+            self._execute(self._insert, new)
+            self._apply_pending(pending_deltas(
+                ((p['address'], p['amount']) for p in new), 1))
+            self._move((p['amount'] for p in new), None, 'ready')
+        return len(new)
+
+    def unpaid_by_address(self):
+        t = self.table
+        res = OrderedDict()
+        for row in self._rows(t.c.txid == None, t.c.locked == False):
+            res.setdefault(row.address, []).append(row)
+        return res
+
+    def unpaid_columns(self):
+        # Straight through the DBAPI, building a PayoutRow per payout costs
+        # far more than the query
+        conn = self.db.session.connection().connection
+        rows = conn.execute(
+            "SELECT pid, address, amount FROM payouts WHERE currency_code = ? "
+            "AND txid IS NULL AND locked = 0",
+            (self.currency_code, )).fetchall()
+        if not rows:
+            return [], [], []
+        return zip(*rows)
+
+    def lock(self, pids, lock_time):
+        if pids:
+            leaving = self._select_state(pids, "txid IS NULL AND locked = 0")
+            self._execute(self._lock, [{'b_pid': pid, 'b_time': lock_time}
+                                       for pid in pids])
+            self._apply_pending(pending_deltas(leaving, -1))
+            self._move((amount for address, amount in leaving), 'ready', 'locked')
+
+    def unlock(self, pids=None):
+        t = self.table
+        if pids is None:
+            entering = list(self._execute(
+                sa.select([t.c.address, t.c.amount])
+                .where(t.c.currency_code == self.currency_code)
+                .where(t.c.txid == None)
+                .where(t.c.locked == True)))
+            count = self._execute(
+                t.update()
+                .where(t.c.currency_code == self.currency_code)
+                .where(t.c.locked == True)
+                .values(locked=False, lock_time=None)).rowcount
+            self._apply_pending(pending_deltas(entering, 1))
+            self._move((amount for address, amount in entering), 'locked', 'ready')
+            return count
+        if not pids:
+            return 0
+        entering = self._select_state(pids, "txid IS NULL AND locked = 1")
+        count = self._execute(self._unlock, [{'b_pid': pid} for pid in pids]).rowcount
+        self._apply_pending(pending_deltas(entering, 1))
+        self._move((amount for address, amount in entering), 'locked', 'ready')
+        return count
+
+    def set_txid(self, pids, txid, paid_time):
+        if pids:
+            unpaid = self._select_in("SELECT address, amount, locked FROM payouts "
+                                     "WHERE txid IS NULL AND pid IN ", pids)
+            leaving = [(address, amount) for address, amount, locked in unpaid
+                       if not locked]
+            self._execute(self._set_txid,
+                          [{'b_pid': pid, 'b_txid': txid, 'b_time': paid_time}
+                           for pid in pids])
+            self._apply_pending(pending_deltas(leaving, -1))
+            self._move((amount for address, amount in leaving),
+                       'ready', 'paid_unassoc')
+            self._move((amount for address, amount, locked in unpaid if locked),
+                       'locked', 'paid_unassoc')
+
+    def mark_associated(self, txid, assoc_time):
+        t = self.table
+        self._move((amount for amount, in self._execute(
+            sa.select([t.c.amount])
+            .where(t.c.txid == txid)
+            .where(t.c.associated == False))), 'paid_unassoc', 'associated')
+        return self._execute(
+            t.update()
+            .where(t.c.txid == txid)
+            .where(t.c.associated == False)
+            .values(associated=True, assoc_time=assoc_time)).rowcount
+
+    def unpaid_locked(self):
+        t = self.table
+        return self._rows(t.c.txid == None, t.c.locked == True)
+
+    def paid_unassociated(self):
+        t = self.table
+        return self._rows(t.c.txid != None, t.c.associated == False)
+
+    def unpaid_unlocked(self):
+        t = self.table
+        return self._rows(t.c.txid == None, t.c.locked == False)
+
+    def paid_associated(self):
+        t = self.table
+        return self._rows(t.c.txid != None, t.c.associated == True)
+
+    def known_txids(self, txids):
+        return set(txid for txid, in self._select_in(
+            "SELECT DISTINCT txid FROM payouts WHERE txid IN ", txids))
+
+    def unpaid(self):
+        t = self.table
+        return self._execute(
+            sa.select([t.c.pid, t.c.address, t.c.amount, t.c.lock_time])
+            .where(t.c.currency_code == self.currency_code)
+            .where(t.c.txid == None)
+            .order_by(t.c.id)).fetchall()
+
+    def oldest_unpaid_time(self, locked=False):
+        t = self.table
+        stmt = (sa.select([sa.func.min(t.c.pull_time, type_=sa.DateTime)])
+                .where(t.c.currency_code == self.currency_code)
+                .where(t.c.txid == None))
+        if not locked:
+            stmt = stmt.where(t.c.locked == False)
+        return self._execute(stmt).scalar()
+
+    def last_paid_time(self):
+        t = self.table
+        return self._execute(
+            sa.select([sa.func.max(t.c.paid_time, type_=sa.DateTime)])
+            .where(t.c.currency_code == self.currency_code)).scalar()
+
+    def locked_count(self):
+        t = self.table
+        return self._execute(
+            sa.select([sa.func.count()])
+            .where(t.c.currency_code == self.currency_code)
+            .where(t.c.txid == None)
+            .where(t.c.locked == True)).scalar()
+
+    def pending_balances(self):
+        pb = self.pending_table
+        res = OrderedDict()
+        for address, amount, count in self._execute(
+                sa.select([pb.c.address, pb.c.amount, pb.c.count])
+                .where(pb.c.currency_code == self.currency_code)
+                .order_by(pb.c.address)):
+            res[address] = (amount, count)
+        return res
+
+    def rebuild_pending_balances(self, balances):
+        pb = self.pending_table
+        self._execute(pb.delete().where(pb.c.currency_code == self.currency_code))
+        if balances:
+            self._execute(pb.insert(),
+                          [{'currency_code': self.currency_code, 'address': address,
+                            'amount': amount, 'count': count}
+                           for address, (amount, count) in balances.iteritems()])
+
+
+class MemoryStorage(Storage):
+    """ Keeps payouts in a dictionary keyed by pid. Changes are journaled so
+    rollback() behaves like the database engines """
+    def __init__(self, db, currency_code):
+        super(MemoryStorage, self).__init__(db, currency_code)
+        self.rows = OrderedDict()
+        self.pending = {}
+        self.next_id = 1
+        self._undo = []
+
+    def setup(self, engine):
+        pass
+
+    def reset(self, engine):
+        self.rows.clear()
+        self.pending.clear()
+        self._undo = []
+        self.load_counters()
+
+    def commit(self):
+        self._undo = []
+        super(MemoryStorage, self).commit()
+
+    def rollback(self):
+        for pid, old in reversed(self._undo):
+            if old is None:
+                del self.rows[pid]
+            else:
+                self.rows[pid] = old
+        if self._undo:
+            self.pending = dict((address, list(balance)) for address, balance
+                                in self.compute_pending_balances().iteritems())
+        self._undo = []
+        super(MemoryStorage, self).rollback()
+
+    def _adjust_pending(self, row, sign):
+        if row.txid is not None or row.locked:
+            return
+        balance = self.pending.setdefault(row.address, [0, 0])
+        balance[0] += sign * to_base_units(row.amount)
+        balance[1] += sign
+        if balance[1] <= 0:
+            del self.pending[row.address]
+
+    def _update(self, pid, **values):
+        old = self.rows[pid]
+        self._undo.append((pid, old))
+        new = self.rows[pid] = old._replace(**values)
+        self._adjust_pending(old, -1)
+        self._adjust_pending(new, 1)
+        if state_of(old) != state_of(new):
+            self._move([old.amount], state_of(old), state_of(new))
+
+    def compute_counters(self):
+        counters = dict.fromkeys(self.states, (0, 0))
+        for row in self._filter(lambda r: True):
+            state = state_of(row)
+            counters[state] = (counters[state][0] + 1,
+                               counters[state][1] + to_base_units(row.amount))
+        return counters
+
+    def _filter(self, pred):
+        return [row for row in self.rows.itervalues()
+                if row.currency_code == self.currency_code and pred(row)]
+
+    def insert_payouts(self, payouts):
+        new = 0
+        for p in payouts:
+            if p['pid'] in self.rows:
+                continue
+            values = dict.fromkeys(columns)
+            values.update(associated=False, locked=False)
+            values.update(p)
+            values['id'] = self.next_id
+            self.next_id += 1
+            row = self.rows[p['pid']] = PayoutRow(**values)
+            self._adjust_pending(row, 1)
+            self._move([row.amount], None, 'ready')
+            self._undo.append((p['pid'], None))
+            new += 1
+        return new
+
+    def unpaid_by_address(self):
+        res = OrderedDict()
+        for row in self.unpaid_unlocked():
+            res.setdefault(row.address, []).append(row)
+        return res
+
+    def unpaid_columns(self):
+        rows = [(r.pid, r.address, r.amount) for r in self.unpaid_unlocked()]
+        if not rows:
+            return [], [], []
+        return zip(*rows)
+
+    def lock(self, pids, lock_time):
+        for pid in pids:
+            self._update(pid, locked=True, lock_time=lock_time)
+
+    def unlock(self, pids=None):
+        if pids is None:
+            pids = [row.pid for row in self._filter(lambda r: r.locked)]
+        for pid in pids:
+            self._update(pid, locked=False, lock_time=None)
+        return len(pids)
+
+    def set_txid(self, pids, txid, paid_time):
+        for pid in pids:
+            self._update(pid, locked=False, txid=txid, paid_time=paid_time)
+
+    def mark_associated(self, txid, assoc_time):
+        rows = [row for row in self.rows.itervalues()
+                if row.txid == txid and not row.associated]
+        for row in rows:
+            self._update(row.pid, associated=True, assoc_time=assoc_time)
+        return len(rows)
+
+    def unpaid_locked(self):
+        return self._filter(lambda r: r.txid is None and r.locked)
+
+    def paid_unassociated(self):
+        return self._filter(lambda r: r.txid is not None and not r.associated)
+
+    def unpaid_unlocked(self):
+        return self._filter(lambda r: r.txid is None and not r.locked)
+
+    def paid_associated(self):
+        return self._filter(lambda r: r.txid is not None and r.associated)
+
+    def known_txids(self, txids):
+        txids = set(txids)
+        return set(r.txid for r in self._filter(lambda r: r.txid in txids))
+
+    def unpaid(self):
+        return [(r.pid, r.address, r.amount, r.lock_time)
+                for r in self._filter(lambda r: r.txid is None)]
+
+    def oldest_unpaid_time(self, locked=False):
+        times = [r.pull_time for r in self._filter(
+            lambda r: r.txid is None and (locked or not r.locked)) if r.pull_time]
+        return min(times) if times else None
+
+    def last_paid_time(self):
+        times = [r.paid_time for r in self._filter(lambda r: r.paid_time)]
+        return max(times) if times else None
+
+    def locked_count(self):
+        return len(self._filter(lambda r: r.txid is None and r.locked))
+
+    def pending_balances(self):
+        return OrderedDict((address, tuple(self.pending[address]))
+                           for address in sorted(self.pending))
+
+    def rebuild_pending_balances(self, balances):
+        self.pending = dict((address, list(balance))
+                            for address, balance in balances.iteritems())
+
+
+storages = {'sqlite': SQLiteStorage,
+            'memory': MemoryStorage}
@@ -0,0 +1,136 @@
+"""
+Combined pulls against a stand-in SC that signs its responses like the real
+one, and can answer combined requests, reject them like an older SC, time out
+or send back a malformed body.
+"""
+import json
+import logging
+import shutil
+import tempfile
+import unittest
+
+import requests
+
+from simplecoin_rpc_client.sc_rpc import SCRPCClient
+from simplecoin_rpc_client.scheduler import PayoutManager
+
+
+CURRENCIES = ('DOGE', 'LTC')
+ADDRESS = 'mipcBbFg9gMiCh81Kj8tqqdgoZub1ZJRfn'
+logger = logging.getLogger('test_combined_pull')
+
+
+class Response(object):
+    def __init__(self, status_code, text):
+        self.status_code = status_code
+        self.text = text
+
+    def json(self):
+        return json.loads(self.text)
+
+
+class StandInSC(object):
+    """ Answers get_payouts the way SC does for the given mode """
+    def __init__(self, serializer, mode='combined'):
+        self.serializer = serializer
+        self.mode = mode
+        self.requests = []
+
+    def post(self, url, timeout=None, data=None):
+        data = self.serializer.loads(data)
+        self.requests.append(data)
+        if 'currencies' in data:
+            if self.mode == 'legacy':
+                return Response(500, "KeyError: 'currency'")
+            if self.mode == 'timeout':
+                raise requests.exceptions.Timeout("Read timed out")
+            if self.mode == 'malformed':
+                return Response(200, self.serializer.dumps({'pids': 5}))
+            return Response(200, self.serializer.dumps({'pids': [
+                ['user', ADDRESS, '0.5', currency + '1', currency]
+                for currency in data['currencies']]}))
+        currency = data['currency']
+        return Response(200, self.serializer.dumps({'pids': [
+            ['user', ADDRESS, '0.5', currency + '1']]}))
+
+
+class StandInCoin(object):
+    coinserv = {'account': 'pool'}
+
+
+class TestCombinedPull(unittest.TestCase):
+    def setUp(self):
+        self.db_dir = tempfile.mkdtemp()
+        self.sc_rpc = {}
+        for currency in CURRENCIES:
+            config = dict(currency_code=currency, valid_address_versions=[111],
+                          rpc_signature='test', rpc_url='http://localhost:9400/',
+                          database_path=self.db_dir + '/rpc_', log_path=None,
+                          combined_pull=True)
+            self.sc_rpc[currency] = SCRPCClient(config, StandInCoin(),
+                                                logger=logger)
+        self.pm = PayoutManager(logger, self.sc_rpc, dict(
+            (currency, client.coin_rpc)
+            for currency, client in self.sc_rpc.iteritems()))
+
+    def tearDown(self):
+        shutil.rmtree(self.db_dir)
+
+    def serve(self, mode):
+        sc = StandInSC(self.sc_rpc['LTC'].serializer, mode)
+        for client in self.sc_rpc.itervalues():
+            client.http = sc
+        return sc
+
+    def stored(self, currency):
+        storage = self.sc_rpc[currency].storage
+        pids = [p.pid for p in storage.unpaid_unlocked()]
+        storage.rollback()
+        return pids
+
+    def test_combined(self):
+        sc = self.serve('combined')
+        self.pm.pull_payouts()
+        self.assertEqual(sc.requests, [{'currencies': list(CURRENCIES)}])
+        for currency in CURRENCIES:
+            self.assertEqual(self.stored(currency), [currency + '1'])
+
+    def test_legacy_falls_back(self):
+        sc = self.serve('legacy')
+        self.pm.pull_payouts()
+        self.assertEqual(sc.requests[1:], [{'currency': currency}
+                                           for currency in CURRENCIES])
+        for currency in CURRENCIES:
+            self.assertEqual(self.stored(currency), [currency + '1'])
+
+    def test_failure_backs_off(self):
+        for mode in ('timeout', 'malformed'):
+            sc = self.serve(mode)
+            intervals = dict(self.pm.pull_interval)
+            for currency in CURRENCIES:
+                self.pm.next_pull[currency] = 0
+            self.pm.pull_payouts()
+            self.assertEqual(len(sc.requests), 1)
+            for currency in CURRENCIES:
+                self.assertGreater(self.pm.pull_interval[currency],
+                                   intervals[currency])
+                self.assertGreater(self.pm.next_pull[currency], 0)
+                self.assertEqual(self.stored(currency), [])
+                self.assertTrue(
+                    self.pm.last_run[currency]['pull_payouts']['failed'])
+
+    def test_success_clears_failure(self):
+        self.serve('timeout')
+        self.pm.pull_payouts()
+        self.serve('combined')
+        for currency in CURRENCIES:
+            self.pm.next_pull[currency] = 0
+        self.pm.pull_payouts()
+        for currency in CURRENCIES:
+            self.assertEqual(list(self.pm.last_run[currency]), ['pull_payouts'])
+            self.assertFalse(
+                self.pm.last_run[currency]['pull_payouts']['failed'])
+
+
+if __name__ == '__main__':
+    unittest.main()
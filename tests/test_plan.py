@@ -0,0 +1,75 @@
+"""
+PayoutPlan built with NumPy and with the array module fallback must agree,
+down to how amounts are rounded to base units and the order ties are ranked
+in.
+"""
+import random
+import unittest
+
+from simplecoin_rpc_client import plan
+from simplecoin_rpc_client.plan import PayoutPlan
+from simplecoin_rpc_client.storage import to_base_units
+
+
+def build(numpy, pids, addresses, amounts, minimum, limit):
+    saved = plan.numpy
+    plan.numpy = numpy
+    try:
+        res = PayoutPlan.from_rows(pids, addresses, amounts, minimum, limit)
+    finally:
+        plan.numpy = saved
+    return (res.amounts.items(), res.counts, res.total, sorted(res.pids),
+            sorted(res.dropped))
+
+
+@unittest.skipIf(plan.numpy is None, "NumPy isn't installed")
+class TestPlanParity(unittest.TestCase):
+    def assertSamePlan(self, addresses, amounts, minimum=0.00000001, limit=10):
+        pids = [str(i) for i in xrange(len(amounts))]
+        args = (pids, addresses, amounts, minimum, limit)
+        numpy_plan = build(plan.numpy, *args)
+        self.assertEqual(numpy_plan, build(None, *args))
+        return numpy_plan
+
+    def test_more_than_8_decimals(self):
+        amounts, counts, total, pids, dropped = self.assertSamePlan(
+            [u'a', u'b', u'a'], [u'0.000000015', u'0.5', u'0.1234567891'])
+        self.assertEqual(total, sum(to_base_units(a) for a in
+                                    (u'0.000000015', u'0.5', u'0.1234567891')))
+
+    def test_exponent(self):
+        amounts, counts, total, pids, dropped = self.assertSamePlan(
+            [u'a', u'b'], [u'1.5e-8', u'2E-3'])
+        self.assertEqual(total, to_base_units(u'1.5e-8') + 200000)
+
+    def test_large_amounts(self):
+        self.assertSamePlan([u'a', u'b'], [u'12345678.12345678', u'0.1'])
+
+    def test_ties_rank_by_address(self):
+        amounts, counts, total, pids, dropped = self.assertSamePlan(
+            [u'c', u'a', u'b', u'd'], [u'0.5', u'0.5', u'0.5', u'0.7'],
+            limit=3)
+        self.assertEqual([address for address, amount in amounts],
+                         [u'd', u'a', u'b'])
+        self.assertEqual(dropped, [(u'c', 0.5)])
+
+    def test_dust_and_output_limit(self):
+        random.seed(0)
+        for trial in xrange(50):
+            n = random.randint(1, 400)
+            addresses = [u'addr{}'.format(random.randint(0, 40))
+                         for i in xrange(n)]
+            amounts = [random.choice(
+                [u'{:.8f}'.format(random.uniform(0, 0.01)),
+                 u'{:.10f}'.format(random.uniform(0, 0.01)),
+                 u'0.000000015', u'0.00001', u'1e-06'])
+                for i in xrange(n)]
+            self.assertSamePlan(addresses, amounts, minimum=0.00001,
+                                limit=random.randint(1, 30))
+
+    def test_str_amounts(self):
+        self.assertSamePlan(['a', 'b', 'a'], ['0.5', '0.000000015', '0.25'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,143 @@
+"""
+reconcile against a stand-in wallet. Matching decides whether locked payouts
+get unlocked and paid again, so these cover the cases where getting it wrong
+would pay twice.
+"""
+import calendar
+import datetime
+import logging
+import shutil
+import tempfile
+import unittest
+
+from simplecoin_rpc_client.sc_rpc import SCRPCClient
+
+
+ADDRESS = 'mipcBbFg9gMiCh81Kj8tqqdgoZub1ZJRfn'
+OTHER = 'mzXZgRmo5RqhPHStgLQZJiJZtWYM3mc2GE'
+logger = logging.getLogger('test_reconcile')
+
+
+class StandInWallet(object):
+    """ Answers listtransactions from a list of transactions, oldest first,
+    paging back from the newest like the daemon """
+    coinserv = {'account': 'pool'}
+
+    def __init__(self, transactions=()):
+        self.transactions = list(transactions)
+        self.calls = []
+
+    def listtransactions(self, account, count=10, skip=0):
+        self.calls.append((count, skip))
+        end = max(0, len(self.transactions) - skip)
+        return self.transactions[max(0, end - count):end]
+
+
+def timestamp(dt):
+    return calendar.timegm(dt.utctimetuple())
+
+
+def send(txid, address, amount, time, fee=-0.0001):
+    return {'category': 'send', 'txid': txid, 'address': address,
+            'amount': -amount, 'fee': fee, 'time': time, 'confirmations': 1}
+
+
+def receive(txid, time):
+    return {'category': 'receive', 'txid': txid, 'address': OTHER,
+            'amount': 1, 'time': time, 'confirmations': 1}
+
+
+class TestReconcile(unittest.TestCase):
+    def setUp(self):
+        self.db_dir = tempfile.mkdtemp()
+        self.wallet = StandInWallet()
+        config = dict(currency_code='LTC', valid_address_versions=[111],
+                      rpc_signature='test', rpc_url='http://localhost:9400/',
+                      database_path=self.db_dir + '/rpc_', log_path=None,
+                      reconcile_page_size=2, reconcile_slack=300)
+        self.sc_rpc = SCRPCClient(config, self.wallet, logger=logger)
+        self.lock_time = datetime.datetime(2014, 1, 1, 12, 0)
+        self.after_lock = timestamp(self.lock_time) + 60
+
+    def tearDown(self):
+        shutil.rmtree(self.db_dir)
+
+    def insert(self, pid, address, amount, lock=True):
+        storage = self.sc_rpc.storage
+        storage.insert_payouts([dict(
+            pid=pid, user='user', address=address, amount=amount,
+            currency_code='LTC', pull_time=datetime.datetime(2014, 1, 1))])
+        if lock:
+            storage.lock([pid], self.lock_time)
+        storage.commit()
+
+    def state(self):
+        storage = self.sc_rpc.storage
+        res = dict((row.pid, (row.txid, row.locked)) for row in
+                   storage.unpaid_locked() + storage.unpaid_unlocked() +
+                   storage.paid_unassociated())
+        storage.rollback()
+        return res
+
+    def test_nothing_locked(self):
+        self.insert('1', ADDRESS, '0.5', lock=False)
+        self.assertEqual(self.sc_rpc.reconcile(), True)
+        self.assertEqual(self.wallet.calls, [])
+
+    def test_match_across_pages(self):
+        self.insert('1', ADDRESS, '0.5')
+        self.insert('2', ADDRESS, '0.25')
+        t = self.after_lock
+        self.wallet.transactions = [send('lost', ADDRESS, 0.75, t)] + [
+            receive('r{}'.format(i), t + i + 1) for i in xrange(4)]
+        matches, unlock = self.sc_rpc.reconcile()
+        self.assertEqual(dict(matches), {'lost': ['1', '2']})
+        self.assertEqual(unlock, [])
+        self.assertEqual(len(self.wallet.calls), 3)
+        self.assertEqual(self.state(), {'1': ('lost', False),
+                                        '2': ('lost', False)})
+
+    def test_unmatched_send_after_lock(self):
+        self.insert('1', ADDRESS, '0.5')
+        self.wallet.transactions = [send('other', ADDRESS, 0.4, self.after_lock)]
+        matches, unlock = self.sc_rpc.reconcile()
+        self.assertEqual(dict(matches), {})
+        self.assertEqual(unlock, [])
+        self.assertEqual(self.state(), {'1': (None, True)})
+
+    def test_no_send_unlocks(self):
+        self.insert('1', ADDRESS, '0.5')
+        old = timestamp(self.lock_time) - 3600
+        self.wallet.transactions = [send('old', ADDRESS, 0.4, old)]
+        matches, unlock = self.sc_rpc.reconcile()
+        self.assertEqual(unlock, ['1'])
+        self.assertEqual(self.state(), {'1': (None, False)})
+
+    def test_prefix_match(self):
+        self.insert('1', ADDRESS, '0.5')
+        self.insert('2', ADDRESS, '0.25')
+        # Pulled after the payout was sent, so not part of it
+        self.insert('3', ADDRESS, '1.0', lock=False)
+        self.wallet.transactions = [send('lost', ADDRESS, 0.75, self.after_lock)]
+        matches, unlock = self.sc_rpc.reconcile()
+        self.assertEqual(dict(matches), {'lost': ['1', '2']})
+        self.assertEqual(self.state(), {'1': ('lost', False),
+                                        '2': ('lost', False),
+                                        '3': (None, False)})
+
+    def test_recorded_txid_ignored(self):
+        self.insert('1', ADDRESS, '0.5')
+        self.sc_rpc.storage.set_txid(['1'], 'paid', self.lock_time)
+        self.sc_rpc.storage.commit()
+        self.insert('2', ADDRESS, '0.5')
+        # Same address and amount as the locked payout, but already recorded
+        self.wallet.transactions = [send('paid', ADDRESS, 0.5, self.after_lock)]
+        matches, unlock = self.sc_rpc.reconcile()
+        self.assertEqual(dict(matches), {})
+        self.assertEqual(unlock, ['2'])
+        self.assertEqual(self.state(), {'1': ('paid', False),
+                                        '2': (None, False)})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,48 @@
+"""
+Replays tests/fixtures/replay against fresh databases. The fixture is a short
+LTC recording starting 2014-01-01 23:00 UTC: two pulls at +10s and +40s, and a
+payout sent by the 23:01 payout cron and associated right after. SC responses
+are signed at their recorded times, so the replay only gets as far as the
+payout if signatures are checked against the virtual clock correctly.
+"""
+import datetime
+import os
+import shutil
+import tempfile
+import unittest
+
+from simplecoin_rpc_client.replay import replay
+
+
+FIXTURES = os.path.join(os.path.dirname(__file__), 'fixtures', 'replay')
+
+
+class TestReplay(unittest.TestCase):
+    def setUp(self):
+        self.db_dir = tempfile.mkdtemp()
+        self.cfg = {
+            'sc_rpc_client': {'rpc_signature': 'replay-fixture',
+                              'rpc_url': 'http://localhost:9400/'},
+            'currencies': [{'currency_code': 'LTC',
+                            'enabled': True,
+                            'valid_address_versions': [111],
+                            'payout_cron': {'hour': 23, 'minute': 1}}],
+        }
+
+    def tearDown(self):
+        shutil.rmtree(self.db_dir)
+
+    def test_replay_fixture(self):
+        replayer, pm, wall, virtual = replay(self.cfg, FIXTURES, self.db_dir)
+        storage = pm.sc_rpc['LTC'].storage
+        paid = storage.paid_associated()
+        self.assertEqual(sorted(p.pid for p in paid), ['1', '2', '3'])
+        self.assertEqual(set(p.trans_id for p in paid), set(['ab' * 32]))
+        self.assertEqual(list(storage.unpaid()), [])
+        # Recorded on the virtual clock, when the 23:01 payout cron fired
+        self.assertEqual(set(p.paid_time for p in paid),
+                         set([datetime.datetime(2014, 1, 1, 23, 1)]))
+
+
+if __name__ == '__main__':
+    unittest.main()
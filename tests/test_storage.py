@@ -0,0 +1,95 @@
+"""
+The sqlite and memory storage engines run through the same sequence of
+changes and must end up with the same payouts, pending balances and status
+counters.
+"""
+import datetime
+import logging
+import shutil
+import tempfile
+import unittest
+
+from simplecoin_rpc_client.sc_rpc import SCRPCClient
+from simplecoin_rpc_client.storage import Storage
+
+
+ADDRESSES = ['mipcBbFg9gMiCh81Kj8tqqdgoZub1ZJRfn',
+             'mzXZgRmo5RqhPHStgLQZJiJZtWYM3mc2GE',
+             'n2eMqTT929pb1RDNuqEnxdaLau1rxy3efi']
+T0 = datetime.datetime(2014, 1, 1)
+logger = logging.getLogger('test_storage')
+
+
+class StandInCoin(object):
+    coinserv = {'account': 'pool'}
+
+
+def payouts(start, count):
+    # Large amounts push the totals past what a float sums exactly
+    return [dict(pid=str(i), user='user', address=ADDRESSES[i % 3],
+                 amount='{}.{:08d}'.format(9000000 + i, 12345677 + i),
+                 currency_code='LTC', pull_time=T0)
+            for i in xrange(start, start + count)]
+
+
+class TestStorageParity(unittest.TestCase):
+    def setUp(self):
+        self.db_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.db_dir)
+
+    def run_sequence(self, engine):
+        config = dict(currency_code='LTC', valid_address_versions=[111],
+                      rpc_signature='test', rpc_url='http://localhost:9400/',
+                      database_path='{}/{}_'.format(self.db_dir, engine),
+                      log_path=None, storage=engine)
+        storage = SCRPCClient(config, StandInCoin(), logger=logger).storage
+        inserted = [storage.insert_payouts(payouts(0, 30))]
+        storage.commit()
+        # Already stored pids are skipped
+        inserted.append(storage.insert_payouts(payouts(25, 10)))
+        storage.commit()
+
+        storage.lock([str(i) for i in xrange(0, 12)], T0)
+        storage.commit()
+        storage.lock([str(i) for i in xrange(12, 20)], T0)
+        storage.rollback()
+        unlocked = [storage.unlock([str(i) for i in xrange(8, 12)])]
+        storage.commit()
+        storage.set_txid([str(i) for i in xrange(0, 4)] + ['20', '21'],
+                         'tx1', T0)
+        storage.set_txid(['4', '5'], 'tx2', T0)
+        storage.commit()
+        marked = storage.mark_associated('tx1', T0)
+        storage.commit()
+        storage.lock(['30', '31'], T0)
+        storage.mark_associated('tx2', T0)
+        storage.rollback()
+
+        rows = sorted(
+            row._replace(id=None) for row in
+            storage.unpaid_locked() + storage.unpaid_unlocked() +
+            storage.paid_unassociated() + storage.paid_associated())
+        result = dict(inserted=inserted, unlocked=unlocked, marked=marked,
+                      rows=rows, pending=dict(storage.pending_balances()),
+                      counters=storage.counters,
+                      computed=storage.compute_counters())
+        storage.rollback()
+        return result
+
+    def test_engines_agree(self):
+        sqlite = self.run_sequence('sqlite')
+        memory = self.run_sequence('memory')
+        self.assertEqual(sqlite['counters'], sqlite['computed'])
+        self.assertEqual(memory['counters'], memory['computed'])
+        for key in sqlite:
+            self.assertEqual(sqlite[key], memory[key], key)
+        self.assertEqual(len(sqlite['rows']), 35)
+
+    def test_interface_is_abstract(self):
+        self.assertRaises(TypeError, Storage, None, 'LTC')
+
+
+if __name__ == '__main__':
+    unittest.main()